@@ -1,14 +1,28 @@
 import streamlit as st
-from utils.pdf_parser import extract_text_from_pdf
-from utils.text_splitter import chunk_text
-from utils.embeddings import build_vector_store
-from utils.llm_groq import build_qa_chain, get_answer
+from utils.pdf_parser import extract_pages_cached, pages_to_text
+from utils.text_splitter import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, iter_token_chunks
+from utils.embeddings import (
+    build_vector_store, compute_index_key, is_vector_store_cached, warm_up_embeddings
+)
+from utils.store_manager import get_store_manager
+from utils.llm_groq import get_qa_chain, stream_answer
+from utils.llm_providers import LLM_PROVIDER
 import os
 import roman
-from utils.utility import parse_student_answers, parse_quiz, clean_quiz_text
-from backend.quiz_generator import generate_quiz
-from utils.export_utils import export_quiz_docx, export_quiz_pdf_bytes
-from PyPDF2 import PdfReader
+from utils.utility import parse_quiz_report, clean_quiz_text
+from backend.quiz_generator import (
+    MAX_CHARS_PER_CLUSTER, complete_quiz, generate_quiz_map_reduce, stream_quiz
+)
+from backend.question_bank import bank_key, get_question_bank
+from backend.grading import (
+    grade_answer_sheets, parse_answer_sheets, question_stats_csv, read_answer_key,
+    student_results_csv
+)
+from utils.export_utils import (
+    EXPORT_FORMATS, export_quiz_cached, export_quiz_variants, get_cached_export, quiz_hash
+)
+import numpy as np
+from utils.tracing import metrics, start_collection, start_metrics_server
 os.environ["STREAMLIT_WATCHER_TYPE"] = "poll"
 from dotenv import load_dotenv
 load_dotenv()
@@ -19,6 +33,48 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")  # keep in .env or export manually
 # Page config
 st.set_page_config(page_title="EdTech Q&A + Quiz Bot", layout="wide")
 
+# Timing spans of this rerun (shown in the sidebar panel at the end of the script)
+run_spans = start_collection()
+start_metrics_server()  # only if METRICS_PORT is set
+
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def _warm_up_embeddings():
+    # Runs once per server process, not on every rerun
+    return warm_up_embeddings()
+
+
+embedding_load_seconds = _warm_up_embeddings()
+
+
+def export_download_button(quiz_data, fmt: str, with_answers: bool):
+    """
+    Download button for one export. Documents are rendered only when requested
+    ("Prepare" click) and memoised per quiz, so answering questions doesn't re-render them.
+    """
+    variant = "With Answers" if with_answers else "Without Answers"
+    label = f"{fmt.upper()} - {variant}"
+    data = get_cached_export(quiz_data, fmt, with_answers)
+
+    if data is None and st.button(f"📄 Prepare Quiz ({label})", key=f"prepare_{fmt}_{with_answers}"):
+        with st.spinner(f"Rendering {fmt.upper()}..."):
+            data = export_quiz_cached(quiz_data, fmt, with_answers)
+
+    if data is not None:
+        if st.download_button(
+            f"⬇️ Download Quiz ({label})",
+            data=data,
+            file_name=f"Quiz_{variant.replace(' ', '_')}.{fmt}",
+            mime=EXPORT_FORMATS[fmt][1],
+            key=f"download_{fmt}_{with_answers}"
+        ):
+            st.success(f"{fmt.upper()} {variant.lower()} downloaded!")
+
+
+# Course indexes and question banks are shared by all sessions in this process
+store_manager = get_store_manager()
+question_bank = get_question_bank()
+
 # Title
 # st.title("📚 EdTech Q&A + Quiz Generator")
 # Title
@@ -29,7 +85,19 @@ st.markdown(
 
 # Sidebar
 st.sidebar.title("Navigation")
-menu = st.sidebar.radio("Go to", ["Upload Document", "Ask Questions", "Generate Quiz"])
+menu = st.sidebar.radio(
+    "Go to", ["Upload Document", "Ask Questions", "Generate Quiz", "Upload Solved Quiz"]
+)
+st.sidebar.caption(f"Embedding model loaded in {embedding_load_seconds:.2f}s")
+
+# Course selection (any course indexed on this server)
+courses = store_manager.courses()
+if courses:
+    current = st.session_state.get("course_id")
+    st.session_state["course_id"] = st.sidebar.selectbox(
+        "Course", courses, index=courses.index(current) if current in courses else 0
+    )
+course_id = st.session_state.get("course_id")
 
 # Upload PDF
 if menu == "Upload Document":
@@ -37,36 +105,82 @@ if menu == "Upload Document":
     uploaded_file = st.file_uploader("Upload your course PDF", type=["pdf"])
     if uploaded_file:
         st.success(f"Uploaded: {uploaded_file.name}")
+        upload_course_id = st.text_input("Course ID", value=os.path.splitext(uploaded_file.name)[0])
         
         with st.spinner("Extracting text..."):
-            text = extract_text_from_pdf(uploaded_file)
+            pages = extract_pages_cached(uploaded_file)
+            text = pages_to_text(pages)
         
-        if "⚠️" in text:
-            st.error(text)
+        if not text.strip():
+            st.error("⚠️ Could not extract text from this PDF. Even OCR failed.")
         else:
             st.subheader("📖 Extracted Text Preview:")
+            methods = sorted({p["method"] for p in pages if p["method"]})
+            st.caption(f"{len(pages)} pages extracted ({', '.join(methods)})")
             st.text_area("Text", text[:1000], height=300)  # preview
+            st.session_state["course_pages"] = pages
             st.session_state["course_text"] = text
             
-        if st.button("Split into Chunks"):
-            chunks = chunk_text(text)
-            st.session_state["chunks"] = chunks
-            st.write(f"✅ Total Chunks Created: {len(chunks)}")
-            st.write(chunks[:3])  # preview first 3 chunks
-
-        if "chunks" in st.session_state:
-            if st.button("Build Vector Store"):
-                vector_store = build_vector_store(st.session_state["chunks"])
-                st.session_state["vector_store"] = vector_store
-                st.success("✅ Vector store created successfully!")
-
-        if "vector_store" in st.session_state:
+            if st.button("Split into Chunks"):
+                chunks, chunk_metadatas = [], []
+                for chunk in iter_token_chunks(pages, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS):
+                    chunks.append(chunk["text"])
+                    chunk_metadatas.append(
+                        {"page": chunk["page"], "start": chunk["start"], "end": chunk["end"]}
+                    )
+                st.session_state["chunks"] = chunks
+                st.session_state["chunk_metadatas"] = chunk_metadatas
+                st.session_state["index_key"] = compute_index_key(
+                    uploaded_file.getvalue(), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+                )
+                st.write(f"✅ Total Chunks Created: {len(chunks)}")
+                st.write(chunks[:3])  # preview first 3 chunks
+
+            if "chunks" in st.session_state:
+                if st.button("Build Vector Store"):
+                    index_key = st.session_state.get("index_key")
+                    from_cache = is_vector_store_cached(index_key)
+                    embed_stats = {}
+                    with st.spinner("Embedding chunks..."):
+                        chunks = st.session_state["chunks"]
+                        metadatas = [
+                            {**meta, "course_id": upload_course_id, "source": uploaded_file.name}
+                            for meta in st.session_state["chunk_metadatas"]
+                        ]
+                        vector_store = build_vector_store(
+                            chunks, cache_key=index_key, doc_id=uploaded_file.name,
+                            stats=embed_stats, metadatas=metadatas
+                        )
+                    store_manager.register(upload_course_id, index_key, vector_store,
+                                           course_text=text)
+                    st.session_state["course_id"] = course_id = upload_course_id
+                    if from_cache:
+                        st.success("✅ Vector store loaded from cache!")
+                    elif "removed" in embed_stats:
+                        st.success(
+                            f"✅ Vector store updated: {embed_stats['added']} new, "
+                            f"{embed_stats['removed']} removed, "
+                            f"{embed_stats['kept']} unchanged chunks."
+                        )
+                    else:
+                        st.success(
+                            f"✅ Vector store created successfully! "
+                            f"({embed_stats['chunks_per_sec']:.1f} chunks/sec)"
+                        )
+
+                    # Pre-generate the course's question bank while the user carries on
+                    if GROQ_API_KEY or LLM_PROVIDER != "groq":
+                        question_bank.build(bank_key(text), text, GROQ_API_KEY, vector_store)
+
+        if course_id in store_manager.courses():
             query = st.text_input("Ask something from the document:")
             if query:
-                docs = st.session_state["vector_store"].similarity_search(query, k=3)
+                docs = store_manager.search(course_id, query, k=3,
+                                            filter={"source": uploaded_file.name})
                 st.write("🔍 Top relevant chunks:")
                 for i, doc in enumerate(docs, 1):
-                    st.write(f"**Chunk {i}:** {doc.page_content[:500]}...")
+                    st.write(f"**Chunk {i} (page {doc.metadata.get('page', '?')}):** "
+                             f"{doc.page_content[:500]}...")
 
 
 # Ask Questions
@@ -74,46 +188,87 @@ elif menu == "Ask Questions":
     st.header("💬 Ask Questions")
 
     # Ensure vector store exists
-    if "vector_store" not in st.session_state:
+    vector_store = store_manager.get(course_id) if course_id else None
+    if vector_store is None:
         st.warning("⚠️ Please upload and process a PDF first!")
     else:
         query = st.text_input("Enter your question")
         
         if st.button("Get Answer"):
-            if not GROQ_API_KEY:
+            if not GROQ_API_KEY and LLM_PROVIDER == "groq":
                 st.error("❌ GROQ_API_KEY not found. Please set it in your environment.")
             else:
-                # build QA chain
-                qa_chain = build_qa_chain(st.session_state["vector_store"], GROQ_API_KEY)
-
-                with st.spinner("Thinking... 🤔"):
-                    answer, sources = get_answer(qa_chain, query)
+                # QA chain (cached per course index / model / k)
+                store_id = store_manager.cache_key(course_id)
+                qa_chain = get_qa_chain(vector_store, GROQ_API_KEY, store_id=store_id)
 
-                # Show results
+                # Show results (answer box first, filled once sources are on screen)
                 st.subheader("🤖 Answer")
-                st.write(answer)
+                answer_box = st.container()
+
+                with st.spinner("Searching the course... 🔍"):
+                    sources, tokens = stream_answer(qa_chain, query, store_id=store_id)
 
                 st.subheader("📚 Sources")
                 for i, src in enumerate(sources, 1):
                     st.write(f"**Source {i}:** {src}...")
+
+                with answer_box:
+                    st.write_stream(tokens)
                     
 
 # Generate Quiz Section
 elif menu == "Generate Quiz":
     st.header("📝 Generate Quiz from Course Material")
 
-    if "course_text" not in st.session_state:
+    # Index, text and question bank all belong to the selected course
+    course_text = store_manager.course_text(course_id) if course_id else None
+    if course_text is None:
         st.warning("⚠️ Please upload a PDF first.")
     else:
         num_qs = st.slider("How many questions?", 3, 10, 5)
+        quiz_bank_key = bank_key(course_text)
+        st.caption(f"Question bank: {question_bank.size(quiz_bank_key)} questions "
+                   f"({question_bank.status(quiz_bank_key)})")
 
         # Generate Quiz
         if st.button("Generate Quiz"):
-            import os
-            with st.spinner("Generating quiz..."):
-                raw_quiz = generate_quiz(st.session_state["course_text"], GROQ_API_KEY, num_qs)
+            vector_store = store_manager.get(course_id)
+            banked_quiz = question_bank.sample(quiz_bank_key, num_qs)
+
+            if banked_quiz:
+                # Pre-generated pool: random quiz without an LLM call
+                st.session_state["quiz"] = banked_quiz
+            elif vector_store is not None and len(course_text) > 2 * MAX_CHARS_PER_CLUSTER:
+                # Long material: one bounded prompt per topic cluster, in parallel
+                with st.spinner("Generating quiz from topic clusters..."):
+                    st.session_state["quiz"] = generate_quiz_map_reduce(
+                        vector_store, GROQ_API_KEY, num_qs
+                    )
+            else:
+                # Show the quiz as it is written, then swap in the interactive version
+                live_quiz = st.empty()
+                with live_quiz.container():
+                    raw_quiz = st.write_stream(stream_quiz(course_text, GROQ_API_KEY, num_qs))
+                live_quiz.empty()
                 cleaned_quiz = clean_quiz_text(raw_quiz)
-                st.session_state["quiz"] = parse_quiz(cleaned_quiz)
+                st.session_state["quiz"], malformed = parse_quiz_report(cleaned_quiz)
+                if malformed:
+                    st.caption("Dropped malformed questions: " + "; ".join(
+                        f"#{m['number']} ({m['reason']})" for m in malformed
+                    ))
+
+            if len(st.session_state["quiz"]) < num_qs:
+                # Regenerate only the missing questions, not the whole quiz
+                with st.spinner("Generating missing questions..."):
+                    st.session_state["quiz"] = complete_quiz(
+                        course_text, GROQ_API_KEY, st.session_state["quiz"], num_qs
+                    )
+
+            if not banked_quiz:
+                # Keep these questions and fill the pool for next time
+                question_bank.add(quiz_bank_key, st.session_state["quiz"])
+                question_bank.build(quiz_bank_key, course_text, GROQ_API_KEY, vector_store)
             st.success("✅ Quiz generated successfully!")
 
         # Display Quiz
@@ -177,80 +332,139 @@ elif menu == "Generate Quiz":
             col1, col2 = st.columns(2)
 
             with col1:
-                pdf_buf_no_ans = export_quiz_pdf_bytes(quiz_data, with_answers=False)
-                if st.download_button(
-                    "⬇️ Download Quiz (PDF - Without Answers)",
-                    data=pdf_buf_no_ans.getvalue(),
-                    # export_quiz_pdf(quiz_data, with_answers=False),
-                    file_name="Quiz_Without_Answers.pdf",
-                    mime="application/pdf"
-                ):
-                    st.success("PDF without answers downloaded!")
-
-                if st.download_button(
-                    "⬇️ Download Quiz (DOCX - Without Answers)",
-                    export_quiz_docx(quiz_data, with_answers=False),
-                    file_name="Quiz_Without_Answers.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                ):
-                    st.success("DOCX without answers downloaded!")
+                export_download_button(quiz_data, "pdf", with_answers=False)
+                export_download_button(quiz_data, "docx", with_answers=False)
 
             with col2:
-                pdf_buf = export_quiz_pdf_bytes(quiz_data, with_answers=True)
-                if st.download_button(
-                    "⬇️ Download Quiz (PDF - With Answers)",
-                    data=pdf_buf.getvalue(),
-                    # export_quiz_pdf(quiz_data, with_answers=True),
-                    file_name="Quiz_With_Answers.pdf",
-                    mime="application/pdf"
-                ):
-                    st.success("PDF with answers downloaded!")
-
-                if st.download_button(
-                    "⬇️ Download Quiz (DOCX - With Answers)",
-                    export_quiz_docx(quiz_data, with_answers=True),
-                    file_name="Quiz_With_Answers.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                ):
-                    
-                    st.success("DOCX with answers downloaded!")
-
-# # Upload Solved Quiz --------------------
-# elif menu == "Upload Solved Quiz":
-#     st.header("📤 Upload Solved Quiz for Evaluation")
-
-#     if "quiz" not in st.session_state:
-#         st.warning("⚠️ Please generate a quiz first.")
-#     else:
-#         uploaded_solved = st.file_uploader("Upload your solved quiz (PDF or TXT)", type=["pdf", "txt"])
-
-#         if uploaded_solved:
-#             # Extract text from PDF or TXT
-#             if uploaded_solved.type == "application/pdf":
-#                 pdf_reader = PdfReader(uploaded_solved)
-#                 solved_text = ""
-#                 for page in pdf_reader.pages:
-#                     solved_text += page.extract_text() + "\n"
-#             else:
-#                 solved_text = uploaded_solved.read().decode("utf-8")
-
-#             student_answers = parse_student_answers(solved_text)
-#             quiz_data = st.session_state["quiz"]
-
-#             # Auto-grade
-#             score = 0
-#             results = []
-
-#             for idx, q in enumerate(quiz_data, 1):
-#                 correct_ans = q["answer"]
-#                 student_ans = student_answers.get(idx, "Not Answered")
-
-#                 if student_ans == correct_ans:
-#                     score += 1
-#                     results.append(f"Q{idx}: ✅ Correct ({student_ans})")
-#                 else:
-#                     results.append(f"Q{idx}: ❌ Wrong (Your: {student_ans}, Correct: {correct_ans})")
-
-#             st.subheader("📊 Evaluation Result")
-#             st.write("\n".join(results))
-#             st.success(f"🏆 Final Score: {score}/{len(quiz_data)}")
\ No newline at end of file
+                export_download_button(quiz_data, "pdf", with_answers=True)
+                export_download_button(quiz_data, "docx", with_answers=True)
+
+            # One randomised paper per student (shuffled questions + options)
+            with st.expander("🏫 Class Papers (randomised variants)"):
+                num_variants = st.number_input("Number of students", 1, 500, 30)
+                variant_formats = st.multiselect("Formats", list(EXPORT_FORMATS), default=["pdf"])
+                if st.button("Build Papers", disabled=not variant_formats):
+                    with st.spinner(f"Rendering {num_variants} papers..."):
+                        st.session_state["variants_zip"] = (
+                            quiz_hash(quiz_data),
+                            export_quiz_variants(quiz_data, int(num_variants), variant_formats)
+                        )
+
+                papers = st.session_state.get("variants_zip")
+                if papers and papers[0] == quiz_hash(quiz_data):
+                    st.download_button(
+                        "⬇️ Download Papers + Answer Key (ZIP)",
+                        data=papers[1],
+                        file_name="Quiz_Papers.zip",
+                        mime="application/zip"
+                    )
+
+# Upload Solved Quiz --------------------
+elif menu == "Upload Solved Quiz":
+    st.header("📤 Upload Solved Quiz for Evaluation")
+
+    if "quiz" not in st.session_state:
+        st.warning("⚠️ Please generate a quiz first.")
+    else:
+        uploaded_solved = st.file_uploader(
+            "Upload solved quizzes (PDF or TXT, one per student, or a ZIP of them)",
+            type=["pdf", "txt", "zip"],
+            accept_multiple_files=True
+        )
+        # Randomised class papers: sheets name their variant ("..._Variant_007.pdf" or a
+        # "Variant: 7" line) and are graded through the answer key of the papers zip
+        uploaded_key = st.file_uploader(
+            "Answer key of the class papers (answer_key.csv or Quiz_Papers.zip), if used",
+            type=["csv", "zip"]
+        )
+
+        answer_key = None
+        if uploaded_key:
+            try:
+                answer_key = read_answer_key(uploaded_key.name, uploaded_key.getvalue())
+            except ValueError as e:
+                st.error(f"⚠️ Could not read the answer key: {e}")
+
+        if uploaded_solved:
+            quiz_data = st.session_state["quiz"]
+
+            # Grade once per (quiz, uploads, key) - downloads and other reruns reuse it
+            grading_key = (
+                quiz_hash(quiz_data), tuple((f.name, f.size) for f in uploaded_solved),
+                (uploaded_key.name, uploaded_key.size) if answer_key else None
+            )
+            results, grading_error = None, None
+            if st.session_state.get("grading", (None, None))[0] == grading_key:
+                results = st.session_state["grading"][1]
+            else:
+                with st.spinner("Extracting and grading answer sheets..."):
+                    sheets = parse_answer_sheets([(f.name, f.getvalue()) for f in uploaded_solved])
+                    try:
+                        results = grade_answer_sheets(quiz_data, sheets, answer_key)
+                        st.session_state["grading"] = (grading_key, results)
+                    except ValueError as e:
+                        grading_error = str(e)
+            students = results["students"] if results else []
+
+            if results and any(s["variant"] and not answer_key for s in students):
+                st.warning("⚠️ Some sheets are from randomised class papers - upload their "
+                           "answer key to grade them.")
+
+            if grading_error:
+                st.error(f"⚠️ {grading_error} Rebuild the class papers from the current quiz.")
+            elif not students:
+                st.warning("⚠️ No PDF or TXT answer sheets found.")
+            elif len(students) == 1:
+                # Single student: per-question feedback
+                student = students[0]
+                lines = []
+                for idx, q in enumerate(quiz_data, 1):
+                    student_ans = str(student["answers"][idx - 1] or "Not Answered")
+                    if student["correct"][idx - 1]:
+                        lines.append(f"Q{idx}: ✅ Correct ({student_ans})")
+                    else:
+                        lines.append(f"Q{idx}: ❌ Wrong (Your: {student_ans}, Correct: {q['answer']})")
+
+                st.subheader("📊 Evaluation Result")
+                st.write("\n".join(lines))
+                st.success(f"🏆 Final Score: {student['score']}/{student['total']}")
+            else:
+                st.subheader(f"📊 Class Results ({len(students)} students)")
+                st.metric("Average Score", f"{np.mean([s['percent'] for s in students]):.1f}%")
+                st.dataframe(
+                    [{key: s[key] for key in
+                      ("student", "variant", "score", "total", "percent", "answered", "error")}
+                     for s in students],
+                    hide_index=True
+                )
+                st.subheader("📈 Question Statistics")
+                st.dataframe(
+                    [{key: value for key, value in q.items() if key != "option_counts"}
+                     for q in results["questions"]],
+                    hide_index=True
+                )
+
+            if students:
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button("⬇️ Student Results (CSV)", student_results_csv(results),
+                                       file_name="student_results.csv", mime="text/csv")
+                with col2:
+                    st.download_button("⬇️ Question Statistics (CSV)", question_stats_csv(results),
+                                       file_name="question_stats.csv", mime="text/csv")
+
+
+# ---------------- Timing Panel ---------------- #
+with st.sidebar.expander("⏱️ Timings"):
+    if run_spans:
+        st.caption("This run")
+        st.dataframe(
+            [{"span": s["name"], "ms": s["duration_ms"], "parent": s["parent"] or "",
+              "error": s["error"] or "", "details": str(s["attrs"]) if s["attrs"] else ""}
+             for s in run_spans],
+            hide_index=True
+        )
+    else:
+        st.caption("Nothing traced in this run.")
+    st.caption("Since server start")
+    st.dataframe(metrics.summary(), hide_index=True)
@@ -0,0 +1,252 @@
+# grading.py
+
+import csv
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils.pdf_parser import extract_pages, pages_to_text
+from utils.tracing import traced
+from utils.utility import parse_student_answers
+
+# Answer sheets are extracted / parsed in worker processes, a few per task
+GRADING_WORKERS = int(os.getenv("GRADING_WORKERS", str(os.cpu_count() or 1)))
+SHEETS_PER_TASK = 16
+
+SHEET_TYPES = (".pdf", ".txt")
+NUM_OPTIONS = 4
+
+# Sheets of randomised class papers name their variant: "alice_Quiz_Variant_007.pdf"
+# in the file name, or a "Variant: 7" line on the sheet itself
+VARIANT_NAME = re.compile(r"variant[ _-]*0*(\d+)", re.IGNORECASE)
+VARIANT_LINE = re.compile(r"^[ \t]*variant\b[^\d\n]*(\d+)[ \t]*$", re.IGNORECASE | re.MULTILINE)
+
+
+# ---------------- Collect Answer Sheets ---------------- #
+def iter_answer_files(files):
+    """
+    Expand uploads into (name, bytes) answer sheets.
+    files: [(file name, bytes), ...]; .zip files are unpacked (PDF / TXT entries only).
+    """
+    for name, data in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for entry in archive.infolist():
+                    entry_name = entry.filename
+                    if entry.is_dir() or entry_name.startswith("__MACOSX/"):
+                        continue
+                    if entry_name.lower().endswith(SHEET_TYPES):
+                        yield entry_name, archive.read(entry)
+        elif name.lower().endswith(SHEET_TYPES):
+            yield name, data
+
+
+def sheet_text(name: str, data: bytes) -> str:
+    """Text of one answer sheet (PDF text layer, OCR for scanned pages, or TXT)."""
+    if name.lower().endswith(".pdf"):
+        # One process per sheet already - no nested page pool
+        return pages_to_text(extract_pages(io.BytesIO(data), workers=1))
+    return data.decode("utf-8", errors="replace")
+
+
+def sheet_variant(name: str, text: str):
+    """Class paper variant a sheet was written on (None = the original quiz)."""
+    match = VARIANT_NAME.search(os.path.basename(name)) or VARIANT_LINE.search(text)
+    return int(match.group(1)) if match else None
+
+
+def _parse_sheets(sheets: list) -> list:
+    """Extract + parse some sheets (runs in a worker process)."""
+    results = []
+    for name, data in sheets:
+        student = os.path.splitext(name)[0]
+        try:
+            text = sheet_text(name, data)
+            # Drop the variant line, or its number would be read as an answer
+            answers = parse_student_answers(VARIANT_LINE.sub("", text))
+            results.append({"student": student, "variant": sheet_variant(name, text),
+                            "answers": answers, "error": ""})
+        except Exception as e:
+            results.append({"student": student, "variant": None, "answers": {}, "error": str(e)})
+    return results
+
+
+@traced()
+def parse_answer_sheets(files, workers: int = GRADING_WORKERS) -> list:
+    """
+    Extract and parse many answer sheets in parallel.
+    Returns [{"student", "variant", "answers": {question_number: "1".."4"}, "error"}, ...]
+    in upload order (answers as numbered on the student's paper).
+    """
+    sheets = list(iter_answer_files(files))
+    batches = [sheets[i:i + SHEETS_PER_TASK] for i in range(0, len(sheets), SHEETS_PER_TASK)]
+
+    if workers <= 1 or len(batches) <= 1:
+        return [result for batch in batches for result in _parse_sheets(batch)]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        # map keeps submission order, so results line up with the uploads
+        return [result for results in pool.map(_parse_sheets, batches) for result in results]
+
+
+# ---------------- Randomised Papers ---------------- #
+def read_answer_key(name: str, data: bytes) -> dict:
+    """
+    Parse the answer_key.csv of export_quiz_variants (or the papers zip holding it).
+    Returns {variant: {question: (original question, [original option key per option], answer)}}.
+    Raises ValueError for anything that isn't such a key.
+    """
+    try:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                data = archive.read("answer_key.csv")
+
+        rows = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+        if "options" not in (rows.fieldnames or []):
+            raise ValueError("Answer key has no option order - rebuild the class papers.")
+
+        answer_key = {}
+        for row in rows:
+            answer_key.setdefault(int(row["variant"]), {})[int(row["question"])] = (
+                int(row["original_question"]), row["options"].split(), row["answer"]
+            )
+        return answer_key
+    except (AttributeError, KeyError, TypeError, UnicodeDecodeError, zipfile.BadZipFile) as e:
+        raise ValueError(f"Not an answer key of the class papers ({e}).") from e
+
+
+def _key_matches(quiz_data, answer_key: dict) -> bool:
+    """Every variant covers each quiz question once, and maps its answer to the quiz's answer."""
+    expected = list(range(1, len(quiz_data) + 1))
+    for questions in answer_key.values():
+        if sorted(source for source, _, _ in questions.values()) != expected:
+            return False
+        for source, options, answer in questions.values():
+            if not answer.isdigit() or not 1 <= int(answer) <= len(options):
+                return False
+            if options[int(answer) - 1] != quiz_data[source - 1]["answer"]:
+                return False
+    return True
+
+
+def apply_answer_key(quiz_data, sheets: list, answer_key: dict = None) -> list:
+    """
+    Map each variant sheet's answers back to the original quiz's question / option numbers,
+    so every sheet is graded against the master key. Sheets without a variant are
+    taken as the original quiz; variant sheets without a matching key are not graded.
+    """
+    if answer_key and not _key_matches(quiz_data, answer_key):
+        # A key of another quiz would silently mis-grade everyone
+        raise ValueError("Answer key doesn't match this quiz.")
+
+    mapped = []
+    for sheet in sheets:
+        variant = sheet.get("variant")
+        if variant is None:
+            mapped.append(sheet)
+        elif not answer_key or variant not in answer_key:
+            reason = (f"variant {variant} not in the answer key" if answer_key
+                      else f"variant {variant} - upload the class papers' answer key")
+            mapped.append({**sheet, "answers": {}, "error": sheet["error"] or reason})
+        else:
+            questions = answer_key[variant]
+            answers = {}
+            for q_num, ans in sheet["answers"].items():
+                if q_num in questions:
+                    source, options, _ = questions[q_num]
+                    if 1 <= int(ans) <= len(options):
+                        answers[source] = options[int(ans) - 1]
+            mapped.append({**sheet, "answers": answers})
+    return mapped
+
+
+# ---------------- Grading ---------------- #
+def answer_matrix(sheets: list, num_questions: int):
+    """Students × questions int8 matrix of chosen options (0 = not answered)."""
+    matrix = np.zeros((len(sheets), num_questions), dtype=np.int8)
+    for row, sheet in enumerate(sheets):
+        for q_num, ans in sheet["answers"].items():
+            if 1 <= q_num <= num_questions:
+                matrix[row, q_num - 1] = int(ans)
+    return matrix
+
+
+@traced()
+def grade_answer_sheets(quiz_data, sheets: list, answer_key: dict = None) -> dict:
+    """
+    Grade every sheet against the quiz in one vectorised pass.
+    Sheets of randomised papers are mapped back through answer_key first (see apply_answer_key),
+    so answers and statistics are in the original quiz's numbering.
+    Returns {"students": [...], "questions": [...]} rows (see the CSV helpers).
+    """
+    sheets = apply_answer_key(quiz_data, sheets, answer_key)
+    num_questions = len(quiz_data)
+    answers = answer_matrix(sheets, num_questions)
+    key = np.array([int(q["answer"]) for q in quiz_data], dtype=np.int8)
+
+    correct = answers == key  # broadcast key over every student
+    answered = answers > 0
+    scores = correct.sum(axis=1)
+    num_students = max(len(sheets), 1)
+    # option_counts[q, o] = students choosing option o + 1 on question q
+    option_counts = (answers[:, :, None] == np.arange(1, NUM_OPTIONS + 1)).sum(axis=0)
+
+    students = [
+        {
+            "student": sheet["student"],
+            "variant": sheet.get("variant"),
+            "score": int(scores[row]),
+            "total": num_questions,
+            "percent": round(100 * scores[row] / max(num_questions, 1), 1),
+            "answered": int(answered[row].sum()),
+            "error": sheet["error"],
+            "answers": answers[row],
+            "correct": correct[row]
+        }
+        for row, sheet in enumerate(sheets)
+    ]
+
+    questions = [
+        {
+            "question": idx + 1,
+            "text": q["question"],
+            "answer": q["answer"],
+            "percent_correct": round(100 * correct[:, idx].sum() / num_students, 1),
+            "percent_unanswered": round(100 * (~answered[:, idx]).sum() / num_students, 1),
+            "option_counts": option_counts[idx].tolist()
+        }
+        for idx, q in enumerate(quiz_data)
+    ]
+    return {"students": students, "questions": questions}
+
+
+# ---------------- CSV Reports ---------------- #
+def student_results_csv(results: dict) -> bytes:
+    """
+    One row per student: score, percent and the chosen option per question
+    (original quiz numbering, also for randomised papers).
+    """
+    num_questions = len(results["questions"])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["student", "variant", "score", "total", "percent", "answered", "error"]
+                    + [f"Q{n}" for n in range(1, num_questions + 1)])
+    for s in results["students"]:
+        writer.writerow([s["student"], s["variant"] or "", s["score"], s["total"], s["percent"],
+                         s["answered"], s["error"]]
+                        + [int(a) or "" for a in s["answers"]])
+    return buffer.getvalue().encode("utf-8")
+
+
+def question_stats_csv(results: dict) -> bytes:
+    """One row per question: correct / unanswered rates and how often each option was chosen."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["question", "text", "answer", "percent_correct", "percent_unanswered"]
+                    + [f"option_{n}" for n in range(1, NUM_OPTIONS + 1)])
+    for q in results["questions"]:
+        writer.writerow([q["question"], q["text"], q["answer"], q["percent_correct"],
+                         q["percent_unanswered"]] + q["option_counts"])
+    return buffer.getvalue().encode("utf-8")
@@ -0,0 +1,196 @@
+# question_bank.py
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from utils import async_llm
+from utils.tracing import traced
+from utils.utility import clean_quiz_text, parse_quiz
+from backend.quiz_generator import (
+    MAX_CHARS_PER_CLUSTER, QUIZ_JSON_MODE, build_quiz_prompt, dedupe_questions,
+    generate_quiz_map_reduce, load_quiz_llm
+)
+
+# One JSON file of parsed questions per course text
+QUESTION_BANK_DIR = os.getenv("QUESTION_BANK_DIR", ".question_bank")
+# Questions generated once per course; quizzes are sampled from this pool
+QUESTION_POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "40"))
+QUESTIONS_PER_CALL = 10
+
+
+def bank_key(course_text: str) -> str:
+    """Same course text → same bank (re-uploads and other sessions reuse it)."""
+    return hashlib.sha256(course_text.encode("utf-8")).hexdigest()
+
+
+# ---------------- Pool Generation ---------------- #
+@traced()
+def generate_question_pool(course_text: str, api_key: str, pool_size: int = QUESTION_POOL_SIZE,
+                           vector_store=None) -> list:
+    """
+    Generate ~pool_size distinct parsed questions for a course.
+    Long texts with an index go through map-reduce (topic clusters);
+    otherwise several quiz prompts over the whole text run in parallel.
+    """
+    if vector_store is not None and len(course_text) > 2 * MAX_CHARS_PER_CLUSTER:
+        num_clusters = max(1, pool_size // QUESTIONS_PER_CALL)
+        return generate_quiz_map_reduce(vector_store, api_key, pool_size, num_clusters)
+
+    # Ask for ~50% extra to cover malformed / duplicate questions
+    num_calls = math.ceil(pool_size * 1.5 / QUESTIONS_PER_CALL)
+    llm = load_quiz_llm(api_key, QUIZ_JSON_MODE)
+    client = async_llm.get_llm_client()
+
+    # Distinct prompts, so the client doesn't coalesce them into one request
+    prompts = [
+        build_quiz_prompt(course_text, QUESTIONS_PER_CALL, QUIZ_JSON_MODE)
+        + f"\nQuestion set {i + 1} of {num_calls}: cover different facts than the other sets."
+        for i in range(num_calls)
+    ]
+
+    async def generate_all():
+        return await asyncio.gather(*[client.ainvoke(llm, prompt) for prompt in prompts])
+
+    questions = [q for response in async_llm.run_async(generate_all())
+                 for q in parse_quiz(clean_quiz_text(response.content))]
+    return dedupe_questions(questions)[:pool_size]
+
+
+# ---------------- Question Bank ---------------- #
+class QuestionBank:
+    """
+    Persistent pool of parsed questions per course (keyed by bank_key).
+    - Pools are generated once in a background thread and saved to disk
+    - Quizzes are random samples from the pool (no LLM call)
+    - Thread-safe, so every Streamlit session can share it
+    """
+
+    def __init__(self, bank_dir: str = QUESTION_BANK_DIR, pool_size: int = QUESTION_POOL_SIZE):
+        self.bank_dir = bank_dir
+        self.pool_size = pool_size
+        self._pools = {}  # key → [question, ...]
+        self._building = {}  # key → Thread
+        self._errors = {}  # key → last build error
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.bank_dir, f"{key}.json")
+
+    def _load(self, key: str) -> list:
+        # Caller holds the lock
+        if key not in self._pools:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    self._pools[key] = json.load(f)["questions"]
+            except (OSError, ValueError, KeyError):
+                self._pools[key] = []
+        return self._pools[key]
+
+    def _save(self, key: str, questions: list):
+        try:
+            os.makedirs(self.bank_dir, exist_ok=True)
+            tmp_path = f"{self._path(key)}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"questions": questions, "updated": time.time()}, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Question bank save skipped: {e}")
+
+    # ---------- pool ---------- #
+    def size(self, key: str) -> int:
+        with self._lock:
+            return len(self._load(key))
+
+    def status(self, key: str) -> str:
+        """One of: building, ready, failed, empty."""
+        with self._lock:
+            if key in self._building:
+                return "building"
+            if self._load(key):
+                return "ready"
+            return "failed" if key in self._errors else "empty"
+
+    def add(self, key: str, questions: list) -> int:
+        """Merge questions into the pool (near-duplicates dropped). Returns the pool size."""
+        # Dedupe (embeds every question) outside the lock, so sample() / status() don't wait
+        with self._lock:
+            pool = list(self._load(key))
+        pool_ids = {id(q) for q in pool}
+        new = [q for q in dedupe_questions(pool + list(questions)) if id(q) not in pool_ids]
+
+        with self._lock:
+            # Another add may have landed meanwhile - append onto the current pool
+            merged = self._load(key) + new
+            self._pools[key] = merged
+            self._save(key, merged)
+            return len(merged)
+
+    def build(self, key: str, course_text: str, api_key: str, vector_store=None) -> bool:
+        """
+        Fill the pool up to pool_size in a background thread.
+        Returns False if the pool is already full or a build is running.
+        """
+        with self._lock:
+            if key in self._building or len(self._load(key)) >= self.pool_size:
+                return False
+            thread = threading.Thread(
+                target=self._build, args=(key, course_text, api_key, vector_store),
+                name=f"question-bank-{key[:8]}", daemon=True
+            )
+            self._building[key] = thread
+            self._errors.pop(key, None)
+        thread.start()
+        return True
+
+    def _build(self, key: str, course_text: str, api_key: str, vector_store):
+        try:
+            questions = generate_question_pool(course_text, api_key, self.pool_size, vector_store)
+            print(f"Question bank {key[:8]}: {self.add(key, questions)} questions")
+        except Exception as e:
+            print(f"Question bank build failed: {e}")
+            with self._lock:
+                self._errors[key] = str(e)
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def wait(self, key: str, timeout: float = None):
+        """Block until a running build for key finishes (benchmarks / scripts)."""
+        with self._lock:
+            thread = self._building.get(key)
+        if thread is not None:
+            thread.join(timeout)
+
+    # ---------- quizzes ---------- #
+    @traced()
+    def sample(self, key: str, num_questions: int, seed=None):
+        """
+        A random quiz of num_questions from the pool, or None if the pool is too small.
+        Questions are copies, so callers may modify them.
+        """
+        with self._lock:
+            pool = self._load(key)
+            if len(pool) < num_questions:
+                return None
+            picked = random.Random(seed).sample(pool, num_questions)
+        return [{**q, "options": dict(q["options"])} for q in picked]
+
+
+# One bank per process
+_bank = None
+_bank_lock = threading.Lock()
+
+
+def get_question_bank():
+    """Return the process-wide QuestionBank."""
+    global _bank
+    if _bank is None:
+        with _bank_lock:
+            if _bank is None:
+                _bank = QuestionBank()
+    return _bank
@@ -1,18 +1,48 @@
 # quiz_generator.py
 
-from langchain_groq import ChatGroq
+import asyncio
+import math
+import os
+import faiss
+import numpy as np
+from utils import async_llm
+from utils.embeddings import get_embeddings, get_vectors
+from utils.llm_groq import load_llm
+from utils.tracing import traced
+from utils.utility import clean_quiz_text, parse_quiz, parse_quiz_report
 
-def generate_quiz(course_text: str, api_key: str, num_questions: int = 5):
+# Map-reduce quiz generation: prompt size per cluster and duplicate threshold
+MAX_CHARS_PER_CLUSTER = 6000
+DUPLICATE_SIMILARITY = 0.9
+
+# Ask the LLM for JSON ({"questions": [...]}) instead of the text format
+QUIZ_JSON_MODE = os.getenv("QUIZ_JSON_MODE", "0") == "1"
+
+JSON_FORMAT = """{"questions": [{"question": "<Question text>",
+                              "options": ["<Option 1>", "<Option 2>", "<Option 3>", "<Option 4>"],
+                              "answer": <1/2/3/4>,
+                              "explanation": "<Why this option is correct>"}]}"""
+
+
+def build_quiz_prompt(course_text: str, num_questions: int = 5, json_mode: bool = False) -> str:
     """
-    Generate a quiz from course text using Groq LLaMA model.
+    Prompt asking for num_questions MCQs in the format parse_quiz expects
+    (or the JSON object parse_quiz_report loads directly, if json_mode).
     """
-    llm = ChatGroq(
-        groq_api_key=api_key,
-        model_name="llama-3.3-70b-versatile",
-        temperature=0.5
-    )
-    
-    prompt = f"""
+    if json_mode:
+        return f"""
+            You are an educational quiz generator. 
+            Based on the following course material, generate {num_questions} multiple choice questions.  
+
+            ⚠️ Output must be a single JSON object, with no other text:
+
+            {JSON_FORMAT}
+
+            Course Material:
+            {course_text}
+            """
+
+    return f"""
             You are an educational quiz generator. 
             Based on the following course material, generate {num_questions} multiple choice questions.  
 
@@ -30,8 +60,133 @@ def generate_quiz(course_text: str, api_key: str, num_questions: int = 5):
             {course_text}
             """
 
-    response = llm.invoke(prompt)
+
+def load_quiz_llm(api_key: str, json_mode: bool = QUIZ_JSON_MODE):
+    """Quiz model; in json_mode the provider is asked for a JSON object response."""
+    llm = load_llm(api_key, "llama-3.3-70b-versatile", temperature=0.5)
+    return llm.bind(response_format={"type": "json_object"}) if json_mode else llm
+
+
+@traced()
+def generate_quiz(course_text: str, api_key: str, num_questions: int = 5,
+                  json_mode: bool = QUIZ_JSON_MODE):
+    """
+    Generate a quiz from course text using Groq LLaMA model (or LLM_PROVIDER).
+    Goes through the shared rate-limited LLM client.
+    With json_mode the response is a JSON object (parse_quiz loads it directly).
+    """
+    llm = load_quiz_llm(api_key, json_mode)
+    response = async_llm.invoke(llm, build_quiz_prompt(course_text, num_questions, json_mode))
     return response.content
 
 
+@traced()
+def complete_quiz(course_text: str, api_key: str, questions: list, num_questions: int,
+                  json_mode: bool = True) -> list:
+    """
+    Top up a quiz that lost malformed questions: one call for just the missing
+    ones (JSON mode by default, so they parse reliably) instead of regenerating.
+    """
+    missing = num_questions - len(questions)
+    if missing <= 0:
+        return questions[:num_questions]
+    extra = parse_quiz(clean_quiz_text(generate_quiz(course_text, api_key, missing, json_mode)))
+    return dedupe_questions(questions + extra)[:num_questions]
+
+
+@traced()
+def stream_quiz(course_text: str, api_key: str, num_questions: int = 5):
+    """
+    Same as generate_quiz, but yields the quiz text token by token as it arrives.
+    """
+    # Always the text format - it is shown to the user while it streams
+    llm = load_llm(api_key, "llama-3.3-70b-versatile", temperature=0.5)
+    for chunk in async_llm.stream(llm, build_quiz_prompt(course_text, num_questions)):
+        yield chunk.content
+
+
+# ---------------- Map-Reduce Quiz Generation ---------------- #
+@traced()
+def _cluster_contexts(vector_store, num_clusters: int, max_chars: int = MAX_CHARS_PER_CLUSTER):
+    """
+    Group the store's chunks into num_clusters topics (k-means on their embeddings)
+    and return one context per cluster: the chunks closest to its centroid,
+    up to max_chars. Prompt size stays bounded however long the book is.
+    """
+    ids = [vector_store.index_to_docstore_id[i] for i in range(vector_store.index.ntotal)]
+    texts = [vector_store.docstore.search(doc_id).page_content for doc_id in ids]
+
+    try:
+        vectors = get_vectors(vector_store)
+    except RuntimeError:
+        # Compressed indexes (e.g. IVF-PQ) can't hand vectors back - re-embed
+        vectors = get_embeddings().embed_documents(texts)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+
+    num_clusters = max(1, min(num_clusters, len(texts)))
+    kmeans = faiss.Kmeans(vectors.shape[1], num_clusters, niter=20, seed=0)
+    kmeans.train(vectors)
+    distances, labels = kmeans.index.search(vectors, 1)
+
+    contexts = []
+    for cluster in range(num_clusters):
+        members = np.where(labels[:, 0] == cluster)[0]
+        members = members[np.argsort(distances[members, 0])]  # most central first
+        context, size = [], 0
+        for row in members:
+            if context and size + len(texts[row]) > max_chars:
+                break
+            context.append(texts[row])
+            size += len(texts[row])
+        if context:
+            contexts.append("\n\n".join(context))
+    return contexts
+
+
+def dedupe_questions(questions: list, threshold: float = DUPLICATE_SIMILARITY) -> list:
+    """Drop questions whose embedding is near-identical to an earlier one."""
+    if not questions:
+        return []
+    vectors = np.asarray(get_embeddings().embed_documents([q["question"] for q in questions]),
+                         dtype="float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+
+    kept = []
+    for i, q in enumerate(questions):
+        if all(vectors[i] @ vectors[j] < threshold for j in kept):
+            kept.append(i)
+    return [questions[i] for i in kept]
+
+
+@traced()
+def generate_quiz_map_reduce(vector_store, api_key: str, num_questions: int = 5,
+                             num_clusters: int = None, json_mode: bool = QUIZ_JSON_MODE):
+    """
+    Quiz generation for long course texts:
+    1. map    - cluster the indexed chunks, one bounded prompt per cluster, all sent in parallel
+    2. reduce - parse, drop near-duplicate questions, keep num_questions
+    Returns parsed questions (same shape as parse_quiz).
+    """
+    contexts = _cluster_contexts(vector_store, num_clusters or num_questions)
+    # Ask for a few extra to cover dropped / duplicate questions
+    per_cluster = math.ceil(num_questions * 1.5 / len(contexts))
+
+    llm = load_quiz_llm(api_key, json_mode)
+    client = async_llm.get_llm_client()
+
+    async def generate_all():
+        return await asyncio.gather(*[
+            client.ainvoke(llm, build_quiz_prompt(context, per_cluster, json_mode))
+            for context in contexts
+        ])
+
+    by_cluster = []
+    for response in async_llm.run_async(generate_all()):
+        questions, malformed = parse_quiz_report(clean_quiz_text(response.content))
+        if malformed:
+            print(f"Map-reduce quiz: dropped {len(malformed)} malformed questions")
+        by_cluster.append(questions)
 
+    # Round-robin across clusters so the kept questions cover every topic
+    questions = [cluster[i] for i in range(per_cluster) for cluster in by_cluster if i < len(cluster)]
+    return dedupe_questions(questions)[:num_questions]
@@ -0,0 +1,287 @@
+# bench_rag.py
+"""
+Benchmark the RAG ingestion + query pipeline with the LLM stubbed out.
+
+Stages per document: extract → chunk → embed/index → retrieval / QA queries.
+Reports wall time, peak RSS, chunks/sec and query p50/p95, and writes JSON
+tagged with the git commit so runs can be compared across commits.
+
+    python benchmarks/bench_rag.py                      # synthetic 10/50/200-page PDFs + sample PDF
+    python benchmarks/bench_rag.py --pages 20 --queries 20 --output out.json
+    python benchmarks/bench_rag.py --fake-embeddings    # no model download (pipeline overhead only)
+    python benchmarks/bench_rag.py --index-report CS101 # FAISS index types on a cached course index
+
+Chunking matches the app (iter_token_chunks with CHUNK_TOKENS / CHUNK_OVERLAP_TOKENS);
+with --fake-embeddings there is no model tokenizer, so chunk_text is timed instead.
+
+Note: peak RSS is the process high-water mark, so it only grows across stages / documents.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+# Must be set before the project modules read them at import time
+os.environ.setdefault("LLM_PROVIDER", "local")
+os.environ.setdefault("LOCAL_LLM_LATENCY", "0")
+os.environ.setdefault("LOCAL_LLM_TOKENS_PER_SEC", "1000000")
+os.environ["INDEX_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_index_")
+os.environ["EXTRACTION_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_extract_")
+
+import numpy as np  # noqa: E402
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.lib.styles import getSampleStyleSheet  # noqa: E402
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate  # noqa: E402
+
+from utils import embeddings  # noqa: E402
+from utils.hybrid_retriever import HybridRetriever  # noqa: E402
+from utils.llm_groq import get_answer, get_qa_chain  # noqa: E402
+from utils.pdf_parser import extract_pages_cached, pages_to_text  # noqa: E402
+from utils.text_splitter import (  # noqa: E402
+    CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, chunk_text, iter_token_chunks
+)
+
+SAMPLE_PDF = os.path.join(PROJECT_DIR, "sample_files", "sql questions.pdf")
+# The app's index cache (streamlit is run from the project folder)
+APP_INDEX_CACHE_DIR = os.path.join(PROJECT_DIR, ".index_cache")
+
+WORDS = (
+    "database table index query join primary foreign key normalization transaction "
+    "commit rollback schema view trigger procedure select insert update delete "
+    "aggregate group order filter constraint unique null default cursor partition"
+).split()
+
+
+# ---------------- Inputs ---------------- #
+def make_synthetic_pdf(num_pages: int, seed: int = 0) -> bytes:
+    """Text PDF with num_pages pages of pseudo course text (same seed → same bytes)."""
+    rng = random.Random(seed)
+    styles = getSampleStyleSheet()
+    story = []
+    for page in range(num_pages):
+        for _ in range(6):
+            sentences = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 16))).capitalize() + "."
+                for _ in range(rng.randint(3, 6))
+            ]
+            story.append(Paragraph(" ".join(sentences), styles["Normal"]))
+        story.append(PageBreak())
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, invariant=1).build(story)
+    return buffer.getvalue()
+
+
+def make_queries(chunks: list, num_queries: int, seed: int = 0) -> list:
+    """Questions built from words of random chunks (always answerable from the index)."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        words = chunks[rng.randrange(len(chunks))].split()
+        start = rng.randrange(max(1, len(words) - 6))
+        queries.append("What about " + " ".join(words[start:start + 6]) + "?")
+    return queries
+
+
+# ---------------- Measurement ---------------- #
+def peak_rss_mb() -> float:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def latency_stats(fn, queries: list) -> dict:
+    latencies = []
+    for query in queries:
+        _, seconds = timed(fn, query)
+        latencies.append(seconds * 1000)
+    return {
+        "queries": len(queries),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(np.mean(latencies)),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def token_chunks(pages: list):
+    """Chunk like the app's upload page: (texts, metadatas)."""
+    chunks = list(iter_token_chunks(pages, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS))
+    metadatas = [{"page": c["page"], "start": c["start"], "end": c["end"]} for c in chunks]
+    return [c["text"] for c in chunks], metadatas
+
+
+def bench_document(name: str, pdf_bytes: bytes, num_queries: int,
+                   fake_embeddings: bool = False) -> dict:
+    result = {"document": name, "pdf_bytes": len(pdf_bytes), "stages": {}}
+    stages = result["stages"]
+
+    pages, seconds = timed(extract_pages_cached, io.BytesIO(pdf_bytes))
+    text = pages_to_text(pages)
+    stages["extract"] = {"seconds": seconds, "chars": len(text), "peak_rss_mb": peak_rss_mb()}
+
+    _, seconds = timed(extract_pages_cached, io.BytesIO(pdf_bytes))
+    stages["extract_cached"] = {"seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+
+    if fake_embeddings:
+        # No model tokenizer without the real embeddings - character chunks instead
+        chunks, seconds = timed(chunk_text, text)
+        metadatas, chunker = None, "chunk_text"
+    else:
+        (chunks, metadatas), seconds = timed(token_chunks, pages)
+        chunker = "iter_token_chunks"
+    stages["chunk"] = {"seconds": seconds, "chunks": len(chunks), "chunker": chunker,
+                       "peak_rss_mb": peak_rss_mb()}
+
+    embed_stats = {}
+    vector_store, seconds = timed(embeddings.build_vector_store, chunks, stats=embed_stats,
+                                  metadatas=metadatas)
+    stages["embed_index"] = {
+        "seconds": seconds,
+        "chunks": len(chunks),
+        "chunks_per_sec": len(chunks) / seconds if seconds > 0 else 0.0,
+        "embed_chunks_per_sec": embed_stats.get("chunks_per_sec"),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+    queries = make_queries(chunks, num_queries)
+    stages["query_vector"] = latency_stats(lambda q: vector_store.similarity_search(q, k=3), queries)
+
+    hybrid = HybridRetriever(vectorstore=vector_store, k=3)
+    hybrid.invoke(queries[0])  # build the BM25 index outside the timed loop
+    stages["query_hybrid"] = latency_stats(hybrid.invoke, queries)
+
+    qa_chain = get_qa_chain(vector_store, api_key=None)
+    stages["query_qa_stub_llm"] = latency_stats(lambda q: get_answer(qa_chain, q), queries)
+    return result
+
+
+# ---------------- Index Types ---------------- #
+def index_report(course: str, cache_dir: str, k: int = 5, num_queries: int = 200) -> list:
+    """
+    Recall / latency of every FAISS index type on the vectors of a cached course index.
+    course: a course ID from the app's registry, or a cache key.
+    """
+    try:
+        with open(os.path.join(cache_dir, "courses.json"), encoding="utf-8") as f:
+            cache_key = json.load(f).get(course, course)
+    except (OSError, ValueError):
+        cache_key = course
+
+    embeddings.INDEX_CACHE_DIR = cache_dir
+    # Only the stored vectors are needed, not the embedding model
+    vector_store = embeddings.load_cached_vector_store(cache_key, None)
+    if vector_store is None:
+        raise SystemExit(f"No cached index for '{course}' in {cache_dir}")
+
+    vectors = embeddings.get_vectors(vector_store)
+    print(f"Index report for {course}: {len(vectors)} vectors, {vectors.shape[1]} dims")
+    return embeddings.benchmark_index_types(vectors, k=k, num_queries=num_queries)
+
+
+# ---------------- Main ---------------- #
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline (LLM stubbed).")
+    parser.add_argument("--pages", type=int, nargs="*", default=[10, 50, 200],
+                        help="synthetic PDF sizes in pages")
+    parser.add_argument("--no-sample", action="store_true", help="skip sample_files PDF")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="deterministic fake embeddings instead of the HF model")
+    parser.add_argument("--output", default=None,
+                        help="JSON file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--index-report", metavar="COURSE",
+                        help="only compare FAISS index types on this cached course index")
+    parser.add_argument("--index-cache-dir", default=APP_INDEX_CACHE_DIR,
+                        help="index cache to read --index-report courses from")
+    args = parser.parse_args()
+
+    if args.index_report:
+        report = index_report(args.index_report, args.index_cache_dir)
+        print(embeddings.format_index_report(report))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"commit": git_commit(), "course": args.index_report,
+                           "index_types": report}, f, indent=2)
+        return
+
+    if args.fake_embeddings:
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        embeddings._embeddings = DeterministicFakeEmbedding(size=384)
+        load_seconds = 0.0
+    else:
+        load_seconds = embeddings.warm_up_embeddings()
+
+    documents = [(f"synthetic_{n}p", make_synthetic_pdf(n)) for n in args.pages]
+    if not args.no_sample and os.path.exists(SAMPLE_PDF):
+        with open(SAMPLE_PDF, "rb") as f:
+            documents.append((os.path.basename(SAMPLE_PDF), f.read()))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "queries": args.queries,
+            "fake_embeddings": args.fake_embeddings,
+            "embedding_model": embeddings.EMBEDDING_MODEL,
+            "embedding_load_seconds": load_seconds,
+            "index_type": embeddings.INDEX_TYPE,
+            "embed_batch_size": embeddings.EMBED_BATCH_SIZE,
+            "embed_workers": embeddings.EMBED_WORKERS,
+            "chunk_tokens": CHUNK_TOKENS,
+            "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS
+        },
+        "results": []
+    }
+
+    for name, pdf_bytes in documents:
+        print(f"Benchmarking {name} ...")
+        result = bench_document(name, pdf_bytes, args.queries, args.fake_embeddings)
+        report["results"].append(result)
+        for stage, metrics in result["stages"].items():
+            detail = (f"p50 {metrics['p50_ms']:.1f}ms p95 {metrics['p95_ms']:.1f}ms"
+                      if "p50_ms" in metrics else f"{metrics['seconds']:.3f}s")
+            print(f"  {stage:<18} {detail:<28} peak RSS {metrics['peak_rss_mb']:.0f} MB")
+
+    output = args.output or os.path.join(PROJECT_DIR, "benchmarks", "results", f"{commit[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# conftest.py
+
+import os
+import sys
+
+# Tests import the app's packages (utils, backend) from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
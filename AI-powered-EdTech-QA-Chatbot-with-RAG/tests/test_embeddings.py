@@ -0,0 +1,53 @@
+# test_embeddings.py
+
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from utils import embeddings
+
+CHUNKS = ["Primary keys identify rows.", "Foreign keys reference other tables.", "Indexes speed up reads."]
+
+
+@pytest.fixture(autouse=True)
+def fake_embeddings(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "_embeddings", DeterministicFakeEmbedding(size=32))
+    monkeypatch.setattr(embeddings, "INDEX_CACHE_DIR", str(tmp_path))
+
+
+def _metadatas(source, first_page=1):
+    return [{"source": source, "page": first_page + i} for i in range(len(CHUNKS))]
+
+
+def test_cache_hit_uses_new_metadata():
+    embeddings.build_vector_store(CHUNKS, cache_key="key", metadatas=_metadatas("old.pdf"))
+    vector_store = embeddings.build_vector_store(CHUNKS, cache_key="key",
+                                                 metadatas=_metadatas("new.pdf"))
+    docs = vector_store.similarity_search(CHUNKS[0], k=3, filter={"source": "new.pdf"})
+    assert len(docs) == 3
+
+
+def test_update_refreshes_kept_chunks():
+    vector_store = embeddings.build_vector_store(CHUNKS, metadatas=_metadatas("a.pdf"))
+    stats = {}
+    # A page inserted before the course: same chunks, pages shifted by one
+    embeddings.update_vector_store(vector_store, CHUNKS, stats=stats,
+                                   metadatas=_metadatas("a.pdf", first_page=2))
+    assert stats["kept"] == 3 and stats["added"] == 0
+    pages = {doc.page_content: doc.metadata["page"]
+             for doc in vector_store.docstore._dict.values()}
+    assert pages == {chunk: i + 2 for i, chunk in enumerate(CHUNKS)}
+
+
+def test_ivf_update_rebuilds_index():
+    chunks = [f"Lecture note {i} about topic {i * 7919 % 1000}." for i in range(2000)]
+    embeddings.build_vector_store(chunks, cache_key="v1", doc_id="course.pdf", index_type="ivf_flat")
+
+    # Drop 100 chunks, add 100 new ones
+    updated = chunks[100:] + [f"New note {i} on revision {i}." for i in range(100)]
+    stats = {}
+    vector_store = embeddings.build_vector_store(updated, cache_key="v2", doc_id="course.pdf",
+                                                 index_type="ivf_flat", stats=stats)
+    assert "removed" not in stats  # not updated in place
+    assert vector_store.index.ntotal == len(updated)
+
+    for chunk in updated[::5]:
+        assert vector_store.similarity_search(chunk, k=1)[0].page_content == chunk
@@ -0,0 +1,52 @@
+# test_grading.py
+
+import pytest
+from backend.grading import grade_answer_sheets, parse_answer_sheets, read_answer_key
+from utils.export_utils import export_quiz_variants, shuffle_quiz
+
+QUIZ = [
+    {"question": f"Question {n}?", "options": {str(o): f"q{n} option {o}" for o in range(1, 5)},
+     "answer": str(n % 4 + 1), "explanation": ""}
+    for n in range(1, 7)
+]
+
+
+def _sheet(answers: dict) -> bytes:
+    return "\n".join(f"Q{q}: {a}" for q, a in answers.items()).encode("utf-8")
+
+
+@pytest.fixture
+def papers():
+    return export_quiz_variants(QUIZ, 3, formats=("docx",), seed=7, workers=1)
+
+
+def test_variant_sheets_graded_against_their_own_key(papers):
+    answer_key = read_answer_key("Quiz_Papers.zip", papers)
+    variant = shuffle_quiz(QUIZ, "7-2")
+    right = {i: q["answer"] for i, q in enumerate(variant, 1)}
+    # Same option numbers as on paper 2, but on the original quiz they'd be mostly wrong
+    sheets = parse_answer_sheets([
+        ("alice_Quiz_Variant_002.txt", _sheet(right)),
+        ("bob.txt", b"Variant: 2\n" + _sheet(right)),
+        ("carol.txt", _sheet({i: q["answer"] for i, q in enumerate(QUIZ, 1)})),
+    ], workers=1)
+    assert [s["variant"] for s in sheets] == [2, 2, None]
+
+    results = grade_answer_sheets(QUIZ, sheets, answer_key)
+    assert [s["score"] for s in results["students"]] == [6, 6, 6]
+    assert [q["percent_correct"] for q in results["questions"]] == [100.0] * 6
+
+
+def test_variant_sheets_need_the_answer_key():
+    sheets = parse_answer_sheets([("dan_Quiz_Variant_001.txt", _sheet({1: "1"}))], workers=1)
+    student = grade_answer_sheets(QUIZ, sheets)["students"][0]
+    assert student["score"] == 0 and "answer key" in student["error"]
+
+
+def test_answer_key_of_another_quiz_is_rejected(papers):
+    answer_key = read_answer_key("Quiz_Papers.zip", papers)
+    other_quiz = [{**q, "answer": "1"} for q in QUIZ]
+    with pytest.raises(ValueError):
+        grade_answer_sheets(other_quiz, [], answer_key)
+    with pytest.raises(ValueError):
+        read_answer_key("answer_key.csv", b"not,a\nkey,file")
@@ -0,0 +1,76 @@
+# test_utility.py
+
+from utils.utility import clean_quiz_text, parse_quiz, parse_quiz_report
+
+OPTIONS = """    1) INNER
+    2) LEFT
+    3) RIGHT
+    4) CROSS"""
+
+
+def _parse(text):
+    return parse_quiz_report(clean_quiz_text(text))
+
+
+def test_strict_format():
+    questions, malformed = _parse(f"""I. Which join keeps all left rows?
+{OPTIONS}
+Answer: 2
+Explanation: LEFT join keeps
+unmatched left rows.""")
+    assert malformed == []
+    assert questions == [{
+        "question": "Which join keeps all left rows?",
+        "options": {"1": "INNER", "2": "LEFT", "3": "RIGHT", "4": "CROSS"},
+        "answer": "2",
+        "explanation": "LEFT join keeps\nunmatched left rows."
+    }]
+
+
+def test_answer_with_prefix():
+    for prefix in ("Correct ", "- ", "**"):
+        questions, malformed = _parse(f"I. Which join keeps all left rows?\n{OPTIONS}\n{prefix}Answer: 2\n")
+        assert malformed == [], prefix
+        assert questions[0]["answer"] == "2"
+
+
+def test_question_text_on_next_line():
+    questions, malformed = _parse(f"I.\nWhich join keeps all left rows?\n{OPTIONS}\nAnswer: 2\n")
+    assert malformed == []
+    assert questions[0]["question"] == "Which join keeps all left rows?"
+
+
+def test_inline_explanation():
+    questions, _ = _parse(f"I. Which join keeps all left rows?\n{OPTIONS}\nAnswer: 2 Explanation: LEFT keeps them.")
+    assert questions[0]["answer"] == "2"
+    assert questions[0]["explanation"] == "LEFT keeps them."
+
+
+def test_malformed_questions_are_reported():
+    text = f"""I. Only three options
+    1) a
+    2) b
+    3) c
+Answer: 1
+
+II. No answer
+{OPTIONS}
+
+III. Good one
+{OPTIONS}
+Answer: 4"""
+    questions, malformed = _parse(text)
+    assert [q["question"] for q in questions] == ["Good one"]
+    assert [(m["number"], m["reason"]) for m in malformed] == [
+        (1, "expected 4 options, found 3"), (2, "missing answer")
+    ]
+    assert parse_quiz(text) == questions
+
+
+def test_json_mode():
+    questions, malformed = parse_quiz_report(
+        '```json\n{"questions": [{"question": "Q?", "options": ["a", "b", "c", "d"], '
+        '"answer": 3, "explanation": "c"}]}\n```'
+    )
+    assert malformed == []
+    assert questions[0]["options"]["3"] == "c" and questions[0]["answer"] == "3"
@@ -0,0 +1,226 @@
+# async_llm.py
+
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+import httpx
+from utils.tracing import traced
+
+# Provider limits (Groq free tier is ~30 requests/minute per key)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_MAX_RETRIES = 5
+
+# Rate limited / overloaded / server errors are worth retrying
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _status_code(error):
+    """HTTP status of a provider error (groq / httpx style), if any."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(error):
+    """Seconds from a Retry-After header, if the provider sent one."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _api_key_of(llm):
+    key = getattr(llm, "groq_api_key", None)
+    return key.get_secret_value() if hasattr(key, "get_secret_value") else key
+
+
+class AsyncLLMClient:
+    """
+    asyncio front-end for LangChain chat models.
+    - at most max_concurrency requests in flight
+    - token-bucket rate limit per API key
+    - retries with jittered exponential backoff on 429 / 5xx
+    - identical concurrent prompts to the same model share one request
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES, base_delay: float = 1.0,
+                 max_delay: float = 30.0):
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets = {}  # api key → TokenBucket
+        self._inflight = {}  # (model, prompt) → Task
+
+    def _bucket(self, llm):
+        if not getattr(llm, "rate_limited", True):
+            return None  # local stand-in models
+        key = _api_key_of(llm)
+        if key not in self._buckets:
+            rate = self.requests_per_minute / 60
+            self._buckets[key] = TokenBucket(rate, capacity=max(1, self.requests_per_minute // 6))
+        return self._buckets[key]
+
+    async def _acquire(self, llm):
+        bucket = self._bucket(llm)
+        if bucket is not None:
+            await bucket.acquire()
+
+    def _backoff_delay(self, attempt: int, error) -> float:
+        # Full jitter, but never sooner than the provider asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, _retry_after(error) or 0)
+
+    def _should_retry(self, error, attempt: int) -> bool:
+        return attempt < self.max_retries and _status_code(error) in RETRYABLE_STATUS
+
+    async def _invoke_with_retries(self, llm, prompt):
+        attempt = 0
+        while True:
+            await self._acquire(llm)
+            async with self._semaphore:
+                try:
+                    return await llm.ainvoke(prompt)
+                except Exception as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+                    delay = self._backoff_delay(attempt, e)
+                    print(f"LLM call failed ({_status_code(e)}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def ainvoke(self, llm, prompt):
+        """Rate-limited, retried llm.ainvoke; concurrent duplicates are coalesced."""
+        key = (id(llm), str(prompt))
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._invoke_with_retries(llm, prompt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller giving up must not cancel the shared request
+        return await asyncio.shield(task)
+
+    async def astream(self, llm, prompt):
+        """Rate-limited llm.astream; retried only if nothing was streamed yet."""
+        attempt = 0
+        while True:
+            await self._acquire(llm)
+            async with self._semaphore:
+                started = False
+                try:
+                    async for chunk in llm.astream(prompt):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if started or not self._should_retry(e, attempt):
+                        raise
+                    delay = self._backoff_delay(attempt, e)
+                    print(f"LLM stream failed ({_status_code(e)}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# ---------------- Shared Event Loop ---------------- #
+# Streamlit runs each session in its own thread, so all LLM traffic goes through
+# one background event loop - that's what makes the limits process-wide.
+_loop = None
+_client = None
+_http_client = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _client, _http_client
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+            _client = AsyncLLMClient()
+            _http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                timeout=60
+            )
+    return _loop
+
+
+def get_llm_client() -> AsyncLLMClient:
+    _get_loop()
+    return _client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Async connection pool shared by every provider client, so keep-alive connections
+    (and TLS sessions) are reused. Only used on the shared loop (all calls are ainvoke / astream).
+    """
+    _get_loop()
+    return _http_client
+
+
+def run_async(coro):
+    """Run a coroutine on the shared LLM loop from sync code and wait for the result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+@traced()
+def invoke(llm, prompt):
+    """Sync wrapper around AsyncLLMClient.ainvoke."""
+    return run_async(get_llm_client().ainvoke(llm, prompt))
+
+
+@traced()
+def stream(llm, prompt):
+    """Sync generator wrapper around AsyncLLMClient.astream."""
+    chunks = queue.Queue()
+
+    async def pump():
+        try:
+            async for chunk in get_llm_client().astream(llm, prompt):
+                chunks.put(("chunk", chunk))
+        except Exception as e:
+            chunks.put(("error", e))
+        finally:
+            chunks.put(("done", None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    try:
+        while True:
+            kind, item = chunks.get()
+            if kind == "chunk":
+                yield item
+            elif kind == "error":
+                raise item
+            else:
+                break
+    finally:
+        future.cancel()  # consumer stopped early
@@ -0,0 +1,96 @@
+# context_compressor.py
+
+import os
+import re
+from functools import lru_cache
+from typing import Any
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from utils.embeddings import get_embeddings
+from utils.tracing import traced
+
+# Compress retrieved chunks before the "stuff" prompt (set to 0 to disable)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+# Sentences less similar to the question than this are dropped
+SENTENCE_SIMILARITY_THRESHOLD = float(os.getenv("SENTENCE_SIMILARITY_THRESHOLD", "0.25"))
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def split_sentences(text: str) -> list:
+    return [s.strip() for s in SENTENCE_PATTERN.split(text) if s.strip()]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    return vectors / (np.linalg.norm(vectors, axis=-1, keepdims=True) + 1e-12)
+
+
+@lru_cache(maxsize=2048)
+def _sentence_vectors(text: str):
+    """Sentences of a chunk + their unit embeddings (chunks repeat across questions)."""
+    sentences = split_sentences(text)
+    if not sentences:
+        return (), np.zeros((0, 1), dtype="float32")
+    return tuple(sentences), _normalize(get_embeddings().embed_documents(sentences))
+
+
+@traced()
+def compress_documents(docs: list, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                       threshold: float = SENTENCE_SIMILARITY_THRESHOLD) -> list:
+    """
+    Trim retrieved chunks to the sentences most similar to the query
+    (embedding similarity, no extra LLM call) and cap the total at token_budget.
+    Kept sentences stay in their original order; docs left empty are dropped.
+    The single best sentence is always kept.
+    """
+    if not docs or token_budget <= 0:
+        return docs
+
+    query_vector = _normalize(get_embeddings().embed_query(query))
+    candidates = []  # (similarity, doc index, sentence index, sentence)
+    per_doc = []
+    for d, doc in enumerate(docs):
+        sentences, vectors = _sentence_vectors(doc.page_content)
+        per_doc.append(sentences)
+        if sentences:
+            for s, similarity in enumerate(vectors @ query_vector):
+                candidates.append((float(similarity), d, s, sentences[s]))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    kept, seen, used = set(), set(), 0
+    for similarity, d, s, sentence in candidates:
+        if kept and similarity < threshold:
+            break
+        cost = estimate_tokens(sentence)
+        # Overlapping chunks repeat sentences - send each one once
+        if sentence in seen or (kept and used + cost > token_budget):
+            continue
+        kept.add((d, s))
+        seen.add(sentence)
+        used += cost
+
+    compressed = []
+    for d, doc in enumerate(docs):
+        sentences = [sentence for s, sentence in enumerate(per_doc[d]) if (d, s) in kept]
+        if sentences:
+            compressed.append(Document(page_content=" ".join(sentences), metadata=doc.metadata))
+    return compressed
+
+
+class CompressingRetriever(BaseRetriever):
+    """Wraps a retriever and compresses its documents (see compress_documents)."""
+
+    base_retriever: Any
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    threshold: float = SENTENCE_SIMILARITY_THRESHOLD
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None):
+        docs = self.base_retriever.invoke(query)
+        return compress_documents(docs, query, self.token_budget, self.threshold)
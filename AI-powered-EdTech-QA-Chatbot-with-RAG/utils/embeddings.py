@@ -1,14 +1,479 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import faiss
+import numpy as np
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import FAISS
+from utils.tracing import traced
 
-def build_vector_store(chunks):
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Saved FAISS indexes live here, one folder per content key
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", ".index_cache")
+
+# Embedding pipeline tuning (chunks per batch, worker processes)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+# FAISS index type: flat (exact), ivf_flat, hnsw, ivf_pq
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_TYPES = ["flat", "ivf_flat", "hnsw", "ivf_pq"]
+
+
+# One embedding model per process, shared by every session / caller
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+# Seconds spent loading the model (None until loaded)
+EMBEDDING_LOAD_SECONDS = None
+
+
+# ---------------- Embedding Service ---------------- #
+def get_embeddings():
+    """
+    Return the process-wide HuggingFaceEmbeddings instance.
+    Loaded lazily on first call; thread-safe so concurrent sessions load it once.
+    """
+    global _embeddings, EMBEDDING_LOAD_SECONDS
+    if _embeddings is not None:
+        return _embeddings
+
+    with _embeddings_lock:
+        if _embeddings is None:
+            start = time.perf_counter()
+            _embeddings = HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL,
+                encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+            )
+            EMBEDDING_LOAD_SECONDS = time.perf_counter() - start
+            print(f"Embedding model loaded in {EMBEDDING_LOAD_SECONDS:.2f}s")
+    return _embeddings
+
+
+@traced()
+def warm_up_embeddings():
+    """
+    Load the model and run one tiny embedding so the first real request
+    doesn't pay for weight loading / lazy init.
+    Returns the model load time in seconds.
+    """
+    get_embeddings().embed_query("warm up")
+    return EMBEDDING_LOAD_SECONDS
+
+
+# ---------------- Embedding Pipeline ---------------- #
+def _iter_batches(chunks, batch_size: int):
+    """Yield lists of at most batch_size chunks, consuming chunks lazily."""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_embed_worker(num_threads: int):
+    """Pool initializer: split CPU cores between workers instead of oversubscribing."""
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    get_embeddings()
+
+
+def _embed_batch(batch):
+    # Runs inside a worker process (uses that process's own model)
+    return get_embeddings().embed_documents(batch)
+
+
+@traced()
+def embed_chunks(chunks, batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+                 stats: dict = None):
+    """
+    Embed chunks in batches. Generator yielding (texts, vectors) per batch, in input order.
+    - workers <= 1: embed in this process with the shared model
+    - workers > 1: fan batches out over a process pool (one model per worker)
+    If a stats dict is passed, it is filled with chunks, seconds and chunks_per_sec.
+    """
+    start = time.perf_counter()
+    count = 0
+
+    if workers <= 1:
+        embeddings = get_embeddings()
+        for batch in _iter_batches(chunks, batch_size):
+            vectors = embeddings.embed_documents(batch)
+            count += len(batch)
+            yield batch, vectors
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_embed_worker,
+                                 initargs=(threads,)) as pool:
+            # Keep a bounded number of batches in flight so memory stays flat
+            pending = deque()
+            for batch in _iter_batches(chunks, batch_size):
+                pending.append((batch, pool.submit(_embed_batch, batch)))
+                if len(pending) >= workers * 2:
+                    done_batch, future = pending.popleft()
+                    count += len(done_batch)
+                    yield done_batch, future.result()
+            while pending:
+                done_batch, future = pending.popleft()
+                count += len(done_batch)
+                yield done_batch, future.result()
+
+    seconds = time.perf_counter() - start
+    if stats is not None:
+        stats["chunks"] = count
+        stats["seconds"] = seconds
+        stats["chunks_per_sec"] = count / seconds if seconds > 0 else 0.0
+    print(f"Embedded {count} chunks in {seconds:.2f}s ({count / max(seconds, 1e-9):.1f} chunks/sec)")
+
+
+# ---------------- Index Cache ---------------- #
+def compute_index_key(file_bytes: bytes, chunk_size: int, chunk_overlap: int,
+                      model_name: str = EMBEDDING_MODEL, index_type: str = INDEX_TYPE) -> str:
+    """
+    Content-addressed key for a vector store.
+    Same PDF bytes + same chunking params + same embedding model + index type → same key.
+    """
+    h = hashlib.sha256()
+    h.update(file_bytes)
+    h.update(f"|{chunk_size}|{chunk_overlap}|{model_name}|{index_type}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _index_path(cache_key: str) -> str:
+    return os.path.join(INDEX_CACHE_DIR, cache_key)
+
+
+def is_vector_store_cached(cache_key: str) -> bool:
+    """Check whether an index for this key is already saved on disk."""
+    return bool(cache_key) and os.path.isdir(_index_path(cache_key))
+
+
+@traced()
+def load_cached_vector_store(cache_key: str, embeddings):
+    """
+    Load a saved FAISS index + docstore for this key.
+    Returns None on a cache miss or if the saved files are unreadable.
+    """
+    if not is_vector_store_cached(cache_key):
+        return None
+    try:
+        # Files are written by save_vector_store below, so unpickling them is safe
+        return FAISS.load_local(_index_path(cache_key), embeddings,
+                                allow_dangerous_deserialization=True)
+    except Exception as e:
+        print(f"Index cache load failed: {e}")
+        return None
+
+
+@traced()
+def save_vector_store(vector_store, cache_key: str):
+    """
+    Save FAISS index + docstore under the cache key.
+    Writes to a temp folder first so a half-written index is never loaded.
+    """
+    path = _index_path(cache_key)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        vector_store.save_local(tmp_path)
+        os.rename(tmp_path, path)
+    except OSError as e:
+        # Another session saved the same key first - theirs is identical
+        print(f"Index cache save skipped: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+# ---------------- ANN Index Factory ---------------- #
+def make_faiss_index(vectors, index_type: str = INDEX_TYPE, nlist: int = None, nprobe: int = 8,
+                     hnsw_m: int = 32, ef_search: int = 64, pq_m: int = 32, pq_bits: int = 8,
+                     train_size: int = 50000):
+    """
+    Build a FAISS index of the given type over vectors (float32 array, one row per chunk).
+    - flat:     exact search (IndexFlatL2)
+    - ivf_flat: inverted lists, exact distances inside the probed lists
+    - hnsw:     graph index, no training needed
+    - ivf_pq:   inverted lists + product quantization (smallest memory)
+    IVF indexes are trained on a random sample of at most train_size vectors.
+    Falls back to flat when there are too few vectors to train on.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}. Use one of {INDEX_TYPES}")
+
+    if nlist is None:
+        # ~4*sqrt(n) lists, but never more than the data can train
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    # IVF k-means wants ~39 points per list, PQ wants 2^bits points per codebook
+    min_train = {"ivf_flat": nlist * 39, "ivf_pq": max(nlist * 39, 2 ** pq_bits)}.get(index_type, 0)
+    if n < min_train:
+        print(f"Only {n} vectors, need {min_train} to train {index_type} - using flat index")
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efSearch = ef_search
+    elif index_type == "ivf_flat":
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+    else:
+        if dim % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{pq_m}x{pq_bits}")
+
+    if not index.is_trained:
+        sample = vectors
+        if n > train_size:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n, train_size, replace=False)]
+        index.train(sample)
+        faiss.extract_index_ivf(index).nprobe = nprobe
+
+    index.add(vectors)
+    return index
+
+
+def get_vectors(vector_store):
+    """Pull all stored vectors back out of a FAISS vector store (row i = docstore position i)."""
+    return vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+
+
+def convert_index(vector_store, index_type: str = INDEX_TYPE, **index_kwargs):
+    """
+    Swap the vector store's flat index for one of INDEX_TYPES.
+    Row order is kept, so the docstore / id mapping stays valid.
+    """
+    if index_type == "flat":
+        return vector_store
+    vector_store.index = make_faiss_index(get_vectors(vector_store), index_type, **index_kwargs)
+    return vector_store
+
+
+def benchmark_index_types(vectors, index_types=INDEX_TYPES, k: int = 5, num_queries: int = 200,
+                          **index_kwargs):
+    """
+    Compare index types against exact flat search on the same vectors.
+    Queries are a random sample of the stored vectors.
+    Returns a list of dicts: index_type, recall_at_k, ms_per_query, build_seconds.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = make_faiss_index(vectors, index_type, **index_kwargs)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        report.append({
+            "index_type": index_type,
+            "recall_at_k": hits / (len(queries) * k),
+            "ms_per_query": ms_per_query,
+            "build_seconds": build_seconds
+        })
+    return report
+
+
+def format_index_report(report, k: int = 5) -> str:
+    """Render benchmark_index_types output as a plain text table."""
+    lines = [f"{'index':<10} {'recall@' + str(k):>9} {'ms/query':>9} {'build s':>8}"]
+    for row in report:
+        lines.append(
+            f"{row['index_type']:<10} {row['recall_at_k']:>9.3f} "
+            f"{row['ms_per_query']:>9.3f} {row['build_seconds']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+# ---------------- Incremental Updates ---------------- #
+def chunk_id(chunk: str) -> str:
+    """Stable docstore id for a chunk = hash of its text."""
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+
+def _unique_chunks(chunks, metadatas=None):
+    """
+    Map chunk id → (text, metadata), keeping first occurrence order
+    (FAISS ids must be unique).
+    """
+    if metadatas is None:
+        metadatas = ({} for _ in chunks)
+    unique = {}
+    for chunk, metadata in zip(chunks, metadatas):
+        unique.setdefault(chunk_id(chunk), (chunk, metadata))
+    return unique
+
+
+def _refresh_metadata(vector_store, chunks: dict):
+    """
+    Overwrite the stored metadata of {id: (text, metadata)} chunks already in the store.
+    Ids only hash the text, so a kept chunk may have moved page or come from a new file name.
+    """
+    for i, (_, metadata) in chunks.items():
+        document = vector_store.docstore.search(i)
+        if not isinstance(document, str):  # search returns a message string for unknown ids
+            document.metadata = dict(metadata)
+
+
+def _latest_path(doc_id: str) -> str:
+    name = hashlib.sha256(doc_id.encode("utf-8")).hexdigest()
+    return os.path.join(INDEX_CACHE_DIR, "latest", name)
+
+
+def _read_latest_key(doc_id: str):
+    """Cache key of the last index built for this document (e.g. file name), if any."""
+    try:
+        with open(_latest_path(doc_id), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_latest_key(doc_id: str, cache_key: str):
+    try:
+        os.makedirs(os.path.dirname(_latest_path(doc_id)), exist_ok=True)
+        with open(_latest_path(doc_id), "w", encoding="utf-8") as f:
+            f.write(cache_key)
+    except OSError as e:
+        print(f"Could not record latest index for {doc_id}: {e}")
+
+
+def _add_chunks(vector_store, chunks: dict, batch_size: int, workers: int, stats: dict):
+    """
+    Embed {id: (text, metadata)} chunks and add them to vector_store (created if None).
+    Returns the vector store.
+    """
+    entries = iter(chunks.items())
+    embeddings = get_embeddings()
+    texts_only = (text for text, _ in chunks.values())
+    for texts, vectors in embed_chunks(texts_only, batch_size, workers, stats):
+        batch = [next(entries) for _ in texts]
+        batch_ids = [i for i, _ in batch]
+        batch_metadatas = [metadata for _, (_, metadata) in batch]
+        if vector_store is None:
+            vector_store = FAISS.from_embeddings(list(zip(texts, vectors)), embedding=embeddings,
+                                                 metadatas=batch_metadatas, ids=batch_ids)
+        else:
+            vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=batch_metadatas,
+                                        ids=batch_ids)
+    return vector_store
+
+
+@traced()
+def update_vector_store(vector_store, chunks, batch_size: int = EMBED_BATCH_SIZE,
+                        workers: int = EMBED_WORKERS, stats: dict = None, metadatas=None):
+    """
+    Bring an existing FAISS store in line with a new list of chunks:
+    - chunks already in the store (same hash) keep their vectors; their metadata is
+      replaced when metadatas are given (pages / source may have changed)
+    - new / changed chunks are embedded and added
+    - chunks no longer present are deleted from the index and docstore
+    Modifies vector_store in place and returns it.
+    Only flat indexes are supported; others raise RuntimeError (HNSW can't delete, and
+    IVF keeps the removed ids' gaps, so rows stop matching the docstore after delete).
+    """
+    if not isinstance(vector_store.index, faiss.IndexFlat):
+        raise RuntimeError(f"{type(vector_store.index).__name__} can't be updated in place")
+
+    stats = {} if stats is None else stats
+    wanted = _unique_chunks(chunks, metadatas)
+    existing = set(vector_store.index_to_docstore_id.values())
+
+    stale = [i for i in existing if i not in wanted]
+    new = {i: entry for i, entry in wanted.items() if i not in existing}
+
+    if stale:
+        vector_store.delete(stale)
+    if metadatas is not None:
+        _refresh_metadata(vector_store, {i: entry for i, entry in wanted.items() if i in existing})
+    if new:
+        _add_chunks(vector_store, new, batch_size, workers, stats)
+
+    stats["added"] = len(new)
+    stats["removed"] = len(stale)
+    stats["kept"] = len(wanted) - len(new)
+    print(f"Incremental update: +{stats['added']} -{stats['removed']} ={stats['kept']}")
+    return vector_store
+
+
+# ---------------- Vector Store ---------------- #
+@traced()
+def build_vector_store(chunks, cache_key: str = None, doc_id: str = None,
+                       batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+                       stats: dict = None, index_type: str = INDEX_TYPE, metadatas=None):
     """
     Convert text chunks into embeddings and store in FAISS.
+    If a cache_key is given, reuse the saved index for it (or save a new one).
+    If a doc_id is given and an older index of that document exists, only the
+    changed chunks are embedded (see update_vector_store).
+    Embedding runs through embed_chunks (batched, optionally multi-process).
+    index_type picks the FAISS index (see make_faiss_index).
+    metadatas (one dict per chunk) are stored with each chunk for filtered search.
     Returns the FAISS vector store.
     """
-    # Use HuggingFace embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    
-    # Create FAISS index from chunks
-    vector_store = FAISS.from_texts(chunks, embedding=embeddings)
+    # Shared HuggingFace embeddings (loaded once per process)
+    embeddings = get_embeddings()
+
+    if cache_key:
+        vector_store = load_cached_vector_store(cache_key, embeddings)
+        if vector_store is not None:
+            # Same bytes, but possibly a new file name / course - use this upload's metadata
+            if metadatas is not None:
+                _refresh_metadata(vector_store, _unique_chunks(chunks, metadatas))
+            if doc_id:
+                _write_latest_key(f"{doc_id}|{index_type}", cache_key)
+            return vector_store
+
+    # Start from the previous version of this document, if we have one
+    vector_store = None
+    if doc_id:
+        doc_id = f"{doc_id}|{index_type}"
+        previous_key = _read_latest_key(doc_id)
+        if previous_key and previous_key != cache_key:
+            vector_store = load_cached_vector_store(previous_key, embeddings)
+
+    if vector_store is not None:
+        try:
+            update_vector_store(vector_store, chunks, batch_size, workers, stats, metadatas)
+        except RuntimeError as e:
+            print(f"Incremental update not supported by this index, rebuilding: {e}")
+            vector_store = None
+
+    if vector_store is None:
+        # Create FAISS index from the first batch, then append the rest as they arrive
+        vector_store = _add_chunks(None, _unique_chunks(chunks, metadatas), batch_size, workers,
+                                   {} if stats is None else stats)
+        if vector_store is not None:
+            convert_index(vector_store, index_type)
+
+    if vector_store is None:
+        raise ValueError("No chunks to embed.")
+
+    if cache_key:
+        save_vector_store(vector_store, cache_key)
+        if doc_id:
+            _write_latest_key(doc_id, cache_key)
     return vector_store
@@ -1,6 +1,15 @@
 # export_utils.py
 
+import csv
+import hashlib
 import io
+import json
+import os
+import random
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document
 from docx.shared import RGBColor
 from reportlab.lib.pagesizes import A4
@@ -8,9 +17,23 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.enums import TA_LEFT
 from reportlab.lib import colors
+from utils.tracing import traced
+
+# Rendered exports kept in memory: (quiz hash, format, with_answers) → bytes
+MAX_CACHED_EXPORTS = 32
+
+# Class-scale exports: worker processes and variants rendered per task
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(os.cpu_count() or 1)))
+VARIANTS_PER_TASK = 10
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+_export_cache = OrderedDict()
+_export_lock = threading.Lock()
 
 
 # ---------------- DOCX Export ---------------- #
+@traced()
 def export_quiz_docx(quiz_data, with_answers=True):
     """
     Export quiz to DOCX.
@@ -54,6 +77,53 @@ def export_quiz_docx(quiz_data, with_answers=True):
 
 
 # ---------------- PDF Export ---------------- #
+# Paragraph styles are built once at import and shared by every export
+_styles = getSampleStyleSheet()
+
+QUESTION_STYLE = ParagraphStyle(
+    name="QuestionStyle",
+    parent=_styles["Heading4"],
+    fontName="Helvetica-Bold",
+    fontSize=12,
+    leading=14,
+    textColor=colors.HexColor("#355E8F"),
+    spaceAfter=4,
+    alignment=TA_LEFT
+)
+
+OPTION_STYLE = ParagraphStyle(
+    name="OptionStyle",
+    parent=_styles["Normal"],
+    fontName="Helvetica",
+    fontSize=10,
+    leading=12,
+    leftIndent=8,
+    spaceAfter=2
+)
+
+ANSWER_STYLE = ParagraphStyle(
+    name="AnswerStyle",
+    parent=_styles["Normal"],
+    fontName="Helvetica-Bold",
+    fontSize=10,
+    leading=12,
+    textColor=colors.HexColor("#009E47"),
+    spaceBefore=6,
+    spaceAfter=2
+)
+
+EXPLANATION_STYLE = ParagraphStyle(
+    name="ExplanationStyle",
+    parent=_styles["Normal"],
+    fontName="Helvetica-Bold",
+    fontSize=9,
+    leading=11,
+    textColor=colors.black,
+    spaceAfter=8
+)
+
+
+@traced()
 def export_quiz_pdf_bytes(quiz_data, with_answers=True):
     """
     Export quiz to PDF with styles.
@@ -71,63 +141,19 @@ def export_quiz_pdf_bytes(quiz_data, with_answers=True):
         topMargin=36, bottomMargin=36
     )
 
-    styles = getSampleStyleSheet()
-
-    question_style = ParagraphStyle(
-        name="QuestionStyle",
-        parent=styles["Heading4"],
-        fontName="Helvetica-Bold",
-        fontSize=12,
-        leading=14,
-        textColor=colors.HexColor("#355E8F"),
-        spaceAfter=4,
-        alignment=TA_LEFT
-    )
-
-    option_style = ParagraphStyle(
-        name="OptionStyle",
-        parent=styles["Normal"],
-        fontName="Helvetica",
-        fontSize=10,
-        leading=12,
-        leftIndent=8,
-        spaceAfter=2
-    )
-
-    answer_style = ParagraphStyle(
-        name="AnswerStyle",
-        parent=styles["Normal"],
-        fontName="Helvetica-Bold",
-        fontSize=10,
-        leading=12,
-        textColor=colors.HexColor("#009E47"),
-        spaceBefore=6,
-        spaceAfter=2
-    )
-
-    explanation_style = ParagraphStyle(
-        name="ExplanationStyle",
-        parent=styles["Normal"],
-        fontName="Helvetica-Bold",
-        fontSize=9,
-        leading=11,
-        textColor=colors.black,
-        spaceAfter=8
-    )
-
     story = []
     for idx, q in enumerate(quiz_data, 1):
         # Question
-        story.append(Paragraph(f"{idx}. {q['question']}", question_style))
+        story.append(Paragraph(f"{idx}. {q['question']}", QUESTION_STYLE))
 
         # Options
         for opt_key, opt_text in q["options"].items():
-            story.append(Paragraph(f"{opt_key}) {opt_text}", option_style))
+            story.append(Paragraph(f"{opt_key}) {opt_text}", OPTION_STYLE))
 
         if with_answers:
             ans_text = f"{q['answer']}) {q['options'].get(q['answer'], '')}"
-            story.append(Paragraph(f"Answer: {ans_text}", answer_style))
-            story.append(Paragraph(f"Explanation: {q.get('explanation','')}", explanation_style))
+            story.append(Paragraph(f"Answer: {ans_text}", ANSWER_STYLE))
+            story.append(Paragraph(f"Explanation: {q.get('explanation','')}", EXPLANATION_STYLE))
 
         story.append(Spacer(1, 10))
 
@@ -136,6 +162,134 @@ def export_quiz_pdf_bytes(quiz_data, with_answers=True):
     return buffer
 
 
+# ---------------- Export Cache ---------------- #
+EXPORT_FORMATS = {
+    "pdf": (export_quiz_pdf_bytes, "application/pdf"),
+    "docx": (export_quiz_docx, DOCX_MIME),
+}
+
+
+def quiz_hash(quiz_data) -> str:
+    """Content hash of a quiz (same questions / options / answers → same hash)."""
+    payload = json.dumps(quiz_data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_export(quiz_data, fmt: str, with_answers: bool = True):
+    """Previously rendered export as bytes, or None if it hasn't been rendered yet."""
+    key = (quiz_hash(quiz_data), fmt, with_answers)
+    with _export_lock:
+        data = _export_cache.get(key)
+        if data is not None:
+            _export_cache.move_to_end(key)
+        return data
+
+
+def export_quiz_cached(quiz_data, fmt: str, with_answers: bool = True) -> bytes:
+    """
+    export_quiz_pdf_bytes / export_quiz_docx (fmt "pdf" / "docx") as bytes,
+    rendered once per quiz content + with_answers and then served from memory.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}. Use one of {list(EXPORT_FORMATS)}")
+
+    data = get_cached_export(quiz_data, fmt, with_answers)
+    if data is not None:
+        return data
+
+    data = EXPORT_FORMATS[fmt][0](quiz_data, with_answers=with_answers).getvalue()
+    with _export_lock:
+        _export_cache[(quiz_hash(quiz_data), fmt, with_answers)] = data
+        while len(_export_cache) > MAX_CACHED_EXPORTS:
+            _export_cache.popitem(last=False)
+    return data
+
+
+# ---------------- Class-Scale Variants ---------------- #
+def shuffle_quiz(quiz_data, seed) -> list:
+    """
+    A variant of the quiz with questions and options in random order
+    (deterministic per seed). Options are renumbered 1..n and answers remapped;
+    "source" is the question's 1-based position in the original quiz and
+    "source_options" its original option keys in the variant's order.
+    """
+    rng = random.Random(seed)
+    order = list(range(len(quiz_data)))
+    rng.shuffle(order)
+
+    variant = []
+    for i in order:
+        q = quiz_data[i]
+        keys = list(q["options"])
+        rng.shuffle(keys)
+        options = {str(n): q["options"][key] for n, key in enumerate(keys, 1)}
+        answer = str(keys.index(q["answer"]) + 1) if q["answer"] in keys else q["answer"]
+        variant.append({**q, "options": options, "answer": answer, "source": i + 1,
+                        "source_options": keys})
+    return variant
+
+
+def _render_variants(quiz_data, variant_numbers, seed, formats, with_answers) -> list:
+    """Render some variants (runs in a worker process). Returns [(file name, bytes), ...]."""
+    files = []
+    for n in variant_numbers:
+        variant = shuffle_quiz(quiz_data, f"{seed}-{n}")
+        for fmt in formats:
+            data = EXPORT_FORMATS[fmt][0](variant, with_answers=with_answers).getvalue()
+            files.append((f"Quiz_Variant_{n:03d}.{fmt}", data))
+    return files
+
+
+def _answer_key_csv(quiz_data, num_variants: int, seed) -> bytes:
+    """
+    One row per variant question: variant, question, answer, original question and
+    original option keys in the variant's order (space separated, read by grading).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["variant", "question", "answer", "original_question", "options"])
+    for n in range(1, num_variants + 1):
+        for idx, q in enumerate(shuffle_quiz(quiz_data, f"{seed}-{n}"), 1):
+            writer.writerow([n, idx, q["answer"], q["source"], " ".join(q["source_options"])])
+    return buffer.getvalue().encode("utf-8")
+
+
+@traced()
+def export_quiz_variants(quiz_data, num_variants: int, formats=("pdf",), with_answers: bool = False,
+                         seed=0, workers: int = EXPORT_WORKERS) -> bytes:
+    """
+    Zip of num_variants randomised papers (questions and options shuffled per
+    variant) in the given formats, plus answer_key.csv for grading.
+    Variants are rendered in batches by a process pool. Returns the zip bytes.
+    """
+    formats = list(formats)
+    for fmt in formats:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}. Use one of {list(EXPORT_FORMATS)}")
+
+    batches = [list(range(start, min(start + VARIANTS_PER_TASK, num_variants + 1)))
+               for start in range(1, num_variants + 1, VARIANTS_PER_TASK)]
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("answer_key.csv", _answer_key_csv(quiz_data, num_variants, seed))
+
+        if workers <= 1 or len(batches) <= 1:
+            results = (_render_variants(quiz_data, batch, seed, formats, with_answers)
+                       for batch in batches)
+            for files in results:
+                for name, data in files:
+                    archive.writestr(name, data)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+                futures = [pool.submit(_render_variants, quiz_data, batch, seed, formats, with_answers)
+                           for batch in batches]
+                # Written in submission order, so the zip layout is deterministic
+                for future in futures:
+                    for name, data in future.result():
+                        archive.writestr(name, data)
+    return buffer.getvalue()
+
 
 # from docx import Document
 # from docx.shared import RGBColor
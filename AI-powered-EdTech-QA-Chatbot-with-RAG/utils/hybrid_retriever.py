@@ -0,0 +1,181 @@
+# hybrid_retriever.py
+
+import math
+import os
+import re
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+from typing import Any
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+from utils.tracing import traced
+
+# "hybrid" (BM25 + vectors) or "vector" (plain FAISS similarity)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Optional CPU cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (empty = off)
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "which", "who",
+    "why", "with"
+}
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+# ---------------- BM25 ---------------- #
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, texts: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term → [(doc_idx, term_freq)]
+        self.doc_lengths = []
+
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                self.postings[term].append((doc_idx, freq))
+
+        n = len(texts)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posts) + 0.5) / (len(posts) + 0.5))
+            for term, posts in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Top-k (doc_idx, score), best first. Only touches docs containing a query term."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, freq in self.postings[term]:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_idx] / (self.avg_length or 1)
+                scores[doc_idx] += idf * freq * (self.k1 + 1) / (freq + self.k1 * norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+# One BM25 index per vector store, rebuilt when the store's size changes
+_bm25_cache = weakref.WeakKeyDictionary()  # vector store → (ntotal, doc ids, BM25Index)
+_bm25_lock = threading.Lock()
+
+
+@traced()
+def get_bm25_index(vectorstore):
+    """BM25 over the same chunks as the FAISS store. Returns (doc ids, BM25Index)."""
+    ntotal = vectorstore.index.ntotal
+    with _bm25_lock:
+        cached = _bm25_cache.get(vectorstore)
+        if cached is not None and cached[0] == ntotal:
+            return cached[1], cached[2]
+
+    doc_ids = [vectorstore.index_to_docstore_id[i] for i in range(ntotal)]
+    index = BM25Index([vectorstore.docstore.search(doc_id).page_content for doc_id in doc_ids])
+    with _bm25_lock:
+        _bm25_cache[vectorstore] = (ntotal, doc_ids, index)
+    return doc_ids, index
+
+
+# ---------------- Fusion + Reranking ---------------- #
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """Merge ranked lists of ids: score(id) = sum of 1 / (k + rank). Best first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker(model_name: str = RERANKER_MODEL):
+    """Process-wide cross-encoder (None when RERANKER_MODEL is not set)."""
+    global _reranker
+    if not model_name:
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            from sentence_transformers import CrossEncoder
+            _reranker = CrossEncoder(model_name, device="cpu")
+    return _reranker
+
+
+@traced()
+def rerank(query: str, docs: list, reranker, budget_ms: float = RERANK_BUDGET_MS,
+           batch_size: int = 4) -> list:
+    """
+    Cross-encoder rerank within a latency budget.
+    Docs are scored in small batches (in their fused order); once the next batch
+    would overrun the budget, the rest keep their fused order after the scored ones.
+    """
+    start = time.perf_counter()
+    scored = []
+    for i in range(0, len(docs), batch_size):
+        batch = docs[i:i + batch_size]
+        scores = reranker.predict([(query, doc.page_content) for doc in batch])
+        scored.extend(zip(scores, batch))
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        per_batch_ms = elapsed_ms / (i // batch_size + 1)
+        if elapsed_ms + per_batch_ms > budget_ms:
+            break
+
+    ranked = [doc for _, doc in sorted(scored, key=lambda item: item[0], reverse=True)]
+    return ranked + docs[len(scored):]
+
+
+# ---------------- Retriever ---------------- #
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + FAISS retrieval over the same chunks, merged with reciprocal rank
+    fusion, optionally reranked by a CPU cross-encoder within a latency budget.
+    Drop-in replacement for vectorstore.as_retriever().
+    """
+
+    vectorstore: Any
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    reranker: Any = None
+    rerank_budget_ms: float = RERANK_BUDGET_MS
+
+    def _vector_ids(self, query: str) -> list:
+        vector = np.asarray([self.vectorstore.embedding_function.embed_query(query)],
+                            dtype="float32")
+        _, rows = self.vectorstore.index.search(vector, self.fetch_k)
+        return [self.vectorstore.index_to_docstore_id[r] for r in rows[0] if r != -1]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None):
+        doc_ids, bm25 = get_bm25_index(self.vectorstore)
+        keyword_ids = [doc_ids[i] for i, _ in bm25.search(query, self.fetch_k)]
+
+        fused = reciprocal_rank_fusion([self._vector_ids(query), keyword_ids], self.rrf_k)
+        docstore = self.vectorstore.docstore
+
+        if self.reranker is None:
+            return [docstore.search(doc_id) for doc_id in fused[:self.k]]
+
+        # Rerank a short list only - cross-encoders cost ~ms per pair on CPU
+        candidates = [docstore.search(doc_id) for doc_id in fused[:self.k * 3]]
+        return rerank(query, candidates, self.reranker, self.rerank_budget_ms)[:self.k]
+
+
+def build_retriever(vectorstore, k: int = 3, mode: str = RETRIEVAL_MODE):
+    """Retriever for the QA chain: hybrid (default) or plain vector similarity."""
+    if mode == "hybrid":
+        return HybridRetriever(vectorstore=vectorstore, k=k, reranker=get_reranker())
+    return vectorstore.as_retriever(search_kwargs={"k": k})
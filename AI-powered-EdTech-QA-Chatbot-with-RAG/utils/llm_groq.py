@@ -1,26 +1,60 @@
 # llm_groq.py
 
-from langchain_groq import ChatGroq
+import threading
+from collections import OrderedDict
 from langchain.chains import RetrievalQA
+from utils import async_llm
+from utils.context_compressor import CONTEXT_TOKEN_BUDGET, CompressingRetriever
+from utils.hybrid_retriever import build_retriever
+from utils.llm_providers import LLM_PROVIDER, create_llm
+from utils.semantic_cache import embed_query, get_answer_cache
+from utils.tracing import traced
 
-def load_groq_llm(api_key: str, model_name: str = "llama-3.3-70b-versatile"):
+# How many QA chains to keep around (one per course index / model / k)
+MAX_CACHED_CHAINS = 16
+
+_llm_cache = {}  # (provider, api_key, model_name, temperature) → chat model
+_chain_cache = OrderedDict()  # (store_id, api_key, model_name, k) → (vectorstore, RetrievalQA)
+_cache_lock = threading.Lock()
+
+
+def load_llm(api_key: str, model_name: str = "llama-3.3-70b-versatile",
+             temperature: float = 0.2, provider: str = LLM_PROVIDER):
     """
-    Initialize Groq LLM (default: LLaMA 3 8B).
+    Initialize the chat model of the configured provider (LLM_PROVIDER: groq / local).
+    Clients are cached per (provider, api_key, model_name, temperature) and share
+    one async connection pool (see async_llm.get_http_client).
     """
-    llm = ChatGroq(
-        groq_api_key=api_key,
-        model_name=model_name,
-        temperature=0.2  # lower temp = more factual, less creative
-    )
+    key = (provider, api_key, model_name, temperature)
+    llm = _llm_cache.get(key)
+    if llm is None:
+        # lower temp = more factual, less creative
+        llm = create_llm(provider, api_key, model_name, temperature,
+                         async_llm.get_http_client())
+        with _cache_lock:
+            llm = _llm_cache.setdefault(key, llm)
     return llm
 
 
-def build_qa_chain(vectorstore, api_key: str, model_name: str = "llama-3.3-70b-versatile"):
+def load_groq_llm(api_key: str, model_name: str = "llama-3.3-70b-versatile",
+                  temperature: float = 0.2):
+    """
+    Initialize Groq LLM (default: LLaMA 3 8B).
+    """
+    return load_llm(api_key, model_name, temperature, provider="groq")
+
+
+def build_qa_chain(vectorstore, api_key: str, model_name: str = "llama-3.3-70b-versatile",
+                   k: int = 3):
     """
-    Build a RetrievalQA chain using Groq + Vectorstore retriever.
+    Build a RetrievalQA chain using the configured LLM + Vectorstore retriever.
+    Retrieval is hybrid BM25 + vector by default (RETRIEVAL_MODE, see utils/hybrid_retriever),
+    and retrieved chunks are trimmed to query-relevant sentences (CONTEXT_TOKEN_BUDGET).
     """
-    llm = load_groq_llm(api_key, model_name)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})  # top 3 chunks
+    llm = load_llm(api_key, model_name)
+    retriever = build_retriever(vectorstore, k)  # top k chunks
+    if CONTEXT_TOKEN_BUDGET > 0:
+        retriever = CompressingRetriever(base_retriever=retriever)
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
         retriever=retriever,
@@ -30,15 +64,100 @@ def build_qa_chain(vectorstore, api_key: str, model_name: str = "llama-3.3-70b-v
     return qa_chain
 
 
-def get_answer(qa_chain, query: str):
+def get_qa_chain(vectorstore, api_key: str, model_name: str = "llama-3.3-70b-versatile",
+                 k: int = 3, store_id: str = None):
     """
-    Run a query through the QA chain and return both answer + sources.
+    Cached build_qa_chain, keyed by (store_id, model_name, k).
+    store_id should change whenever the index changes (e.g. its cache key);
+    defaults to the vector store object's id.
     """
-    result = qa_chain(query)
-    answer = result["result"]
+    key = (store_id or id(vectorstore), api_key, model_name, k)
+    with _cache_lock:
+        cached_store, qa_chain = _chain_cache.get(key, (None, None))
+        # A reloaded store is a new object - don't keep serving (and holding) the old one
+        if qa_chain is not None and cached_store is vectorstore:
+            _chain_cache.move_to_end(key)
+            return qa_chain
+
+    qa_chain = build_qa_chain(vectorstore, api_key, model_name, k)
+    with _cache_lock:
+        _chain_cache[key] = (vectorstore, qa_chain)
+        while len(_chain_cache) > MAX_CACHED_CHAINS:
+            _chain_cache.popitem(last=False)
+    return qa_chain
+
 
+def format_sources(docs) -> list:
+    """Preview of each source document, prefixed with its page when known."""
     sources = []
-    for doc in result.get("source_documents", []):
-        sources.append(doc.page_content[:300])  # take preview of each source
+    for doc in docs:
+        preview = doc.page_content[:300]  # take preview of each source
+        page = doc.metadata.get("page")
+        sources.append(f"[Page {page}] {preview}" if page else preview)
+    return sources
+
+
+@traced()
+def _retrieve_and_prompt(qa_chain, query: str):
+    """
+    Run the chain's retriever and build the prompt its "stuff" step would send.
+    Returns (docs, llm, prompt).
+    """
+    docs = qa_chain.retriever.invoke(query)
+    llm_chain = qa_chain.combine_documents_chain.llm_chain
+    prompt = llm_chain.prompt.format_prompt(
+        context="\n\n".join(doc.page_content for doc in docs),
+        question=query
+    )
+    return docs, llm_chain.llm, prompt
+
+
+@traced()
+def get_answer(qa_chain, query: str, store_id: str = None):
+    """
+    Run a query through the QA chain and return both answer + sources.
+    The LLM call goes through the shared rate-limited client (utils/async_llm).
+    With a store_id, near-identical earlier questions on the same index are
+    answered from the semantic cache without calling the LLM.
+    """
+    if store_id:
+        query_vector = embed_query(query)
+        cached = get_answer_cache().lookup(store_id, query_vector)
+        if cached is not None:
+            return cached
 
+    docs, llm, prompt = _retrieve_and_prompt(qa_chain, query)
+    answer = async_llm.invoke(llm, prompt).content
+    sources = format_sources(docs)
+
+    if store_id:
+        get_answer_cache().add(store_id, query_vector, answer, sources)
     return answer, sources
+
+
+@traced()
+def stream_answer(qa_chain, query: str, store_id: str = None):
+    """
+    Streaming version of get_answer, using the same retriever, prompt and LLM as qa_chain.
+    Retrieval runs before returning, so sources can be shown right away.
+    Returns (sources, token generator).
+    """
+    if store_id:
+        query_vector = embed_query(query)
+        cached = get_answer_cache().lookup(store_id, query_vector)
+        if cached is not None:
+            answer, sources = cached
+            return sources, iter([answer])
+
+    docs, llm, prompt = _retrieve_and_prompt(qa_chain, query)
+    sources = format_sources(docs)
+
+    def tokens():
+        parts = []
+        for chunk in async_llm.stream(llm, prompt):
+            parts.append(chunk.content)
+            yield chunk.content
+        if store_id:
+            get_answer_cache().add(store_id, query_vector, "".join(parts), sources)
+
+    return sources, tokens()
@@ -0,0 +1,140 @@
+# llm_providers.py
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import roman
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# "groq" (default) or "local" (offline fake, for benchmarks / CI)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+
+# Fake model speed: time to first token and streaming throughput
+LOCAL_LLM_LATENCY = float(os.getenv("LOCAL_LLM_LATENCY", "0.2"))
+LOCAL_LLM_TOKENS_PER_SEC = float(os.getenv("LOCAL_LLM_TOKENS_PER_SEC", "200"))
+
+
+# ---------------- Local Fake Model ---------------- #
+class LocalFakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for a hosted chat model.
+    - Quiz prompts get a well-formed quiz (same prompt → same quiz), as JSON
+      when called with response_format={"type": "json_object"}
+    - Anything else gets an answer built from the first context sentence
+    Latency and token throughput are configurable, so the RAG / quiz paths can
+    be benchmarked without network or API keys.
+    """
+
+    latency_seconds: float = LOCAL_LLM_LATENCY
+    tokens_per_second: float = LOCAL_LLM_TOKENS_PER_SEC
+    # Not a real provider - skip the API rate limiter (utils/async_llm)
+    rate_limited: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake"
+
+    # ---------- response text ---------- #
+    def _respond(self, messages, response_format=None) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        json_mode = (response_format or {}).get("type") == "json_object"
+        quiz_match = re.search(r"generate (\d+) multiple choice questions", prompt)
+        if quiz_match:
+            return self._fake_quiz(prompt, int(quiz_match.group(1)), json_mode)
+        return self._fake_answer(prompt)
+
+    def _fake_quiz(self, prompt: str, num_questions: int, json_mode: bool = False) -> str:
+        material = prompt.split("Course Material:", 1)[-1]
+        words = re.findall(r"[A-Za-z]{4,}", material) or ["topic"]
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+
+        questions = []
+        for i in range(num_questions):
+            word = words[(seed + i * 7) % len(words)]
+            answer = (seed >> i) % 4 + 1
+            questions.append({
+                "question": f"What does the material say about {word} ({i + 1})?",
+                "options": [f"{word} option {n}" for n in range(1, 5)],
+                "answer": answer,
+                "explanation": f"Option {answer} matches the course material on {word}."
+            })
+        if json_mode:
+            return json.dumps({"questions": questions})
+
+        blocks = []
+        for i, q in enumerate(questions):
+            options = "\n".join(f"    {n}) {opt}" for n, opt in enumerate(q["options"], 1))
+            blocks.append(
+                f"{roman.toRoman(i + 1)}. {q['question']}\n"
+                f"{options}\n"
+                f"Answer: {q['answer']}\n"
+                f"Explanation: {q['explanation']}"
+            )
+        return "\n\n".join(blocks)
+
+    def _fake_answer(self, prompt: str) -> str:
+        # Skip the instructions of the "stuff" QA prompt, keep the retrieved context
+        context = re.split(r"-{8,}|answer\.\n\n", prompt, maxsplit=1)[-1]
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", context) if len(s.strip()) > 20]
+        first = sentences[0] if sentences else "no context was provided"
+        return f"Based on the course material: {first}"
+
+    def _tokens(self, text: str):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    # ---------- LangChain hooks ---------- #
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages, kwargs.get("response_format"))
+        time.sleep(self.latency_seconds + len(self._tokens(text)) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages, kwargs.get("response_format"))
+        await asyncio.sleep(self.latency_seconds + len(self._tokens(text)) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_seconds)
+        for token in self._tokens(self._respond(messages, kwargs.get("response_format"))):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_seconds)
+        for token in self._tokens(self._respond(messages, kwargs.get("response_format"))):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+# ---------------- Provider Registry ---------------- #
+def _create_groq(api_key: str, model_name: str, temperature: float, http_async_client=None):
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        groq_api_key=api_key,
+        model_name=model_name,
+        temperature=temperature,
+        http_async_client=http_async_client
+    )
+
+
+def _create_local(api_key: str, model_name: str, temperature: float, http_async_client=None):
+    return LocalFakeChatModel()
+
+
+PROVIDERS = {
+    "groq": _create_groq,
+    "local": _create_local,
+}
+
+
+def create_llm(provider: str, api_key: str, model_name: str, temperature: float,
+               http_async_client=None):
+    """Create a chat model from the named provider (see PROVIDERS)."""
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {provider}. Use one of {list(PROVIDERS)}")
+    return PROVIDERS[provider](api_key, model_name, temperature, http_async_client)
@@ -1,11 +1,30 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 from PyPDF2 import PdfReader
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 from io import BytesIO
+from utils.tracing import record_span, span, traced
 
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
+# Page-parallel extraction: worker processes and pages handled per task
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = 8
+
+# OCR rasterization: lower DPI / grayscale = less memory per page image
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_GRAYSCALE = True
+
+# Per-page extraction results, one JSON file per PDF hash
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", ".extraction_cache")
+
 
 def extract_text_pdfplumber(file) -> str:
     """Try extracting text with pdfplumber"""
@@ -32,44 +51,228 @@ def extract_text_pypdf2(file) -> str:
     return "\n".join(text)
 
 
-def extract_text_ocr(file) -> str:
-    """Final fallback: OCR for scanned PDFs"""
+@contextmanager
+def _pdf_temp_file(data: bytes):
+    """
+    Write PDF bytes to a temp file once and yield its path (removed afterwards).
+    pdf2image's *_from_bytes helpers write a new temp copy on every call.
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_ocr_pages(pdf_path: str, dpi: int = OCR_DPI, grayscale: bool = OCR_GRAYSCALE,
+                   first_page: int = 1, last_page: int = None):
+    """
+    Streaming OCR: rasterise one page at a time, OCR it, release the image.
+    Memory stays at ~one page image regardless of PDF length.
+    Yields (page_no, text) with 1-based page numbers.
+    """
+    if last_page is None:
+        last_page = pdfinfo_from_path(pdf_path)["Pages"]
+
+    for page_no in range(first_page, last_page + 1):
+        yield page_no, _ocr_page(pdf_path, page_no, dpi, grayscale)
+
+
+@traced()
+def extract_text_ocr(file, dpi: int = OCR_DPI, grayscale: bool = OCR_GRAYSCALE) -> str:
+    """Final fallback: OCR for scanned PDFs (streamed page by page)"""
     text = []
-    images = convert_from_bytes(file.read())  # convert each page to image
-    for i, img in enumerate(images):
-        txt = pytesseract.image_to_string(img)
-        if txt.strip():
-            text.append(txt)
+    with _pdf_temp_file(file.read()) as pdf_path:
+        for _, txt in iter_ocr_pages(pdf_path, dpi, grayscale):
+            if txt.strip():
+                text.append(txt)
     return "\n".join(text)
 
 
-def extract_text_from_pdf(file) -> str:
+# ---------------- Page-level Extraction ---------------- #
+def _ocr_page(pdf_path: str, page_no: int, dpi: int = OCR_DPI,
+              grayscale: bool = OCR_GRAYSCALE) -> str:
+    """OCR a single page (1-based) of the PDF file, rasterising only that page."""
+    images = convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale,
+                               first_page=page_no, last_page=page_no)
+    if not images:
+        return ""
+    img = images[0]
+    try:
+        return pytesseract.image_to_string(img)
+    finally:
+        img.close()
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> list:
+    """
+    Extract pages [start, end) (0-based) from a PDF file.
+    Per page: text layer via pdfplumber → PyPDF2 → OCR only if the page has no text.
+    Returns list of {"page": 1-based number, "text": str, "method": str or None, "seconds": float}.
+    """
+    results = []
+    reader = None
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in range(start, end):
+            text, method = "", None
+            page_start = time.perf_counter()
+
+            try:
+                text = pdf.pages[i].extract_text() or ""
+                method = "pdfplumber"
+            except Exception as e:
+                print(f"pdfplumber failed on page {i + 1}: {e}")
+
+            if not text.strip():
+                try:
+                    reader = reader or PdfReader(pdf_path)
+                    text = reader.pages[i].extract_text() or ""
+                    method = "PyPDF2"
+                except Exception as e:
+                    print(f"PyPDF2 failed on page {i + 1}: {e}")
+
+            if not text.strip():
+                try:
+                    text = _ocr_page(pdf_path, i + 1)
+                    method = "OCR"
+                except Exception as e:
+                    print(f"OCR failed on page {i + 1}: {e}")
+
+            results.append({
+                "page": i + 1,
+                "text": text,
+                "method": method if text.strip() else None,
+                # Timed here, not with spans: this may run in a worker process
+                "seconds": time.perf_counter() - page_start
+            })
+    return results
+
+
+def _page_count(data: bytes) -> int:
+    try:
+        return len(PdfReader(BytesIO(data)).pages)
+    except Exception:
+        with pdfplumber.open(BytesIO(data)) as pdf:
+            return len(pdf.pages)
+
+
+def _record_page_spans(pages: list) -> list:
+    """Per-page extraction time by method (pdf.pdfplumber / pdf.PyPDF2 / pdf.OCR)."""
+    for p in pages:
+        record_span(f"pdf.{p['method'] or 'no_text'}", p.get("seconds", 0) * 1000, page=p["page"])
+    return pages
+
+
+@traced()
+def extract_pages(file, workers: int = PDF_WORKERS) -> list:
     """
-    Extract text from PDF with multiple fallbacks.
-    Priority: pdfplumber → PyPDF2 → OCR.
+    Extract text page by page, deciding the method per page
+    (text layer first, OCR only for pages without text).
+    Large PDFs are split into page ranges handled by a process pool.
+    The PDF is written to one temp file, so tasks carry its path instead of the bytes.
+    Returns pages in order: [{"page", "text", "method"}, ...]
     """
-    text = ""
+    file.seek(0)
+    data = file.read()
+    num_pages = _page_count(data)
+
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages))
+              for start in range(0, num_pages, PAGES_PER_TASK)]
+
+    with _pdf_temp_file(data) as pdf_path:
+        if workers <= 1 or len(ranges) <= 1:
+            return _record_page_spans([
+                page for start, end in ranges for page in _extract_page_range(pdf_path, start, end)
+            ])
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+            futures = [pool.submit(_extract_page_range, pdf_path, start, end)
+                       for start, end in ranges]
+            # Collect in submission order so pages stay in order
+            return _record_page_spans([page for future in futures for page in future.result()])
+
+
+# ---------------- Extraction Cache ---------------- #
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def pages_to_text(pages: list) -> str:
+    """Join extracted pages into one string (pages without text are skipped)."""
+    return "\n".join(p["text"] for p in pages if p["text"].strip())
+
+
+def _extract_pages_with_fallback(file) -> list:
     try:
-        text = extract_text_pdfplumber(file)
+        return extract_pages(file)
     except Exception as e:
-        print(f"pdfplumber failed: {e}")
+        print(f"Page-level extraction failed: {e}")
+
+    try:
+        # Unreadable structure - last resort: OCR the whole file
+        file.seek(0)
+        with _pdf_temp_file(file.read()) as pdf_path:
+            return [
+                {"page": page_no, "text": txt, "method": "OCR" if txt.strip() else None}
+                for page_no, txt in iter_ocr_pages(pdf_path)
+            ]
+    except Exception as e:
+        print(f"OCR failed: {e}")
+    return []
+
+
+def extract_pages_cached(file) -> list:
+    """
+    extract_pages with an on-disk cache keyed by the file's hash.
+    Stores per-page text + method used, so re-uploads skip extraction / OCR.
+    Returns [{"page", "text", "method"}, ...]
+    """
+    with span("pdf_parser.extract_pages_cached") as attrs:
+        file.seek(0)
+        path = os.path.join(EXTRACTION_CACHE_DIR, f"{file_hash(file.read())}.json")
 
-    if not text.strip():
         try:
-            text = extract_text_pypdf2(file)
-        except Exception as e:
-            print(f"PyPDF2 failed: {e}")
+            with open(path, encoding="utf-8") as f:
+                pages = json.load(f)["pages"]
+            attrs["cache_hit"] = True
+            return pages
+        except (OSError, ValueError, KeyError):
+            pass
 
-    if not text.strip():
+        attrs["cache_hit"] = False
+        pages = _extract_pages_with_fallback(file)
+        attrs["pages"] = len(pages)
+        _save_extraction(path, pages)
+        return pages
+
+
+def _save_extraction(path: str, pages: list):
+    # Don't cache failures - a later run may have OCR available
+    if pages_to_text(pages).strip():
         try:
-            # reset file pointer for OCR
-            file.seek(0)
-            text = extract_text_ocr(file)
-        except Exception as e:
-            print(f"OCR failed: {e}")
+            os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"pages": pages}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Extraction cache save skipped: {e}")
+
+
+def extract_text_from_pdf(file) -> str:
+    """
+    Extract text from PDF with multiple fallbacks, decided per page.
+    Priority: pdfplumber → PyPDF2 → OCR (see extract_pages).
+    Results are cached per file (see extract_pages_cached).
+    """
+    text = pages_to_text(extract_pages_cached(file))
 
     if not text.strip():
         return "⚠️ Could not extract text from this PDF. Even OCR failed."
     
     return text
-
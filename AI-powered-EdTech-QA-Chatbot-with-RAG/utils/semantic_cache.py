@@ -0,0 +1,80 @@
+# semantic_cache.py
+
+import os
+import threading
+import time
+import numpy as np
+from utils.embeddings import get_embeddings
+from utils.tracing import traced
+
+# Cosine similarity above which two questions count as "the same question"
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+MAX_ENTRIES_PER_STORE = 500
+
+
+@traced()
+def embed_query(query: str):
+    """Unit-length query embedding (so dot product = cosine similarity)."""
+    vector = np.asarray(get_embeddings().embed_query(query), dtype="float32")
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class SemanticAnswerCache:
+    """
+    Answers to earlier questions, per course index (store_id).
+    A new question reuses a stored answer + sources when its embedding is
+    within the similarity threshold of a previous one on the same index.
+    Entries expire after ttl_seconds; invalidate(store_id) drops an index's entries.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES_PER_STORE):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}  # store_id → list of (vector, answer, sources, created_at)
+        self._lock = threading.Lock()
+
+    def _live_entries(self, store_id):
+        # Caller holds the lock
+        cutoff = time.time() - self.ttl_seconds
+        entries = [e for e in self._entries.get(store_id, []) if e[3] >= cutoff]
+        self._entries[store_id] = entries
+        return entries
+
+    def lookup(self, store_id, query_vector):
+        """Return (answer, sources) of the closest cached question, or None."""
+        with self._lock:
+            entries = self._live_entries(store_id)
+            if not entries:
+                return None
+            similarities = np.stack([e[0] for e in entries]) @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            _, answer, sources, _ = entries[best]
+            return answer, list(sources)
+
+    def add(self, store_id, query_vector, answer: str, sources: list):
+        with self._lock:
+            entries = self._live_entries(store_id)
+            entries.append((query_vector, answer, list(sources), time.time()))
+            if len(entries) > self.max_entries:
+                del entries[:len(entries) - self.max_entries]
+
+    def invalidate(self, store_id=None):
+        """Forget answers for one index (e.g. after it was rebuilt), or everything."""
+        with self._lock:
+            if store_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(store_id, None)
+
+
+# One cache per process, shared by all sessions
+_answer_cache = SemanticAnswerCache()
+
+
+def get_answer_cache():
+    return _answer_cache
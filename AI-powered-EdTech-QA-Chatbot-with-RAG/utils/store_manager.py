@@ -0,0 +1,213 @@
+# store_manager.py
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from utils.embeddings import (
+    INDEX_CACHE_DIR, get_embeddings, is_vector_store_cached,
+    load_cached_vector_store, save_vector_store
+)
+from utils.semantic_cache import get_answer_cache
+from utils.tracing import traced
+
+# How many course indexes stay in memory before the coldest is dropped
+MAX_STORES_IN_MEMORY = int(os.getenv("MAX_STORES_IN_MEMORY", "8"))
+
+# course_id → cache key, so evicted / restarted courses can be reloaded
+COURSES_FILE = os.path.join(INDEX_CACHE_DIR, "courses.json")
+# Extracted course text per cache key (quizzes need the text behind the index)
+COURSE_TEXT_DIR = os.path.join(INDEX_CACHE_DIR, "texts")
+
+
+class VectorStoreManager:
+    """
+    Holds the FAISS indexes of many courses in one process.
+    - Namespaced by course ID (one index per course)
+    - LRU: only max_in_memory indexes are kept loaded, colder ones are
+      saved to disk (index cache) and reloaded on the next request
+    - Thread-safe, so every Streamlit session can share it
+    """
+
+    def __init__(self, max_in_memory: int = MAX_STORES_IN_MEMORY):
+        self.max_in_memory = max_in_memory
+        self._stores = OrderedDict()  # course_id → vector store (most recent last)
+        self._keys = self._load_course_keys()  # course_id → cache key
+        self._texts = {}  # cache key → course text of loaded stores
+        self._saving = {}  # course_id → evicted store still being written to disk
+        self._loading = {}  # course_id → lock held while its index loads from disk
+        # Guards the dicts only; index loads / saves happen outside it
+        self._lock = threading.Lock()
+
+    # ---------- course registry ---------- #
+    def _load_course_keys(self):
+        try:
+            with open(COURSES_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_course_keys(self):
+        try:
+            os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+            with open(COURSES_FILE, "w", encoding="utf-8") as f:
+                json.dump(self._keys, f, indent=2)
+        except OSError as e:
+            print(f"Could not save course registry: {e}")
+
+    def courses(self):
+        """All known course IDs (loaded or on disk)."""
+        with self._lock:
+            return sorted(self._keys)
+
+    def cache_key(self, course_id: str):
+        """Cache key of the course's current index (changes whenever it is rebuilt)."""
+        with self._lock:
+            return self._keys.get(course_id)
+
+    # ---------- course text ---------- #
+    def _text_path(self, cache_key: str) -> str:
+        return os.path.join(COURSE_TEXT_DIR, f"{cache_key}.txt")
+
+    def _save_course_text(self, cache_key: str, course_text: str):
+        try:
+            os.makedirs(COURSE_TEXT_DIR, exist_ok=True)
+            with open(self._text_path(cache_key), "w", encoding="utf-8") as f:
+                f.write(course_text)
+        except OSError as e:
+            print(f"Could not save course text: {e}")
+
+    def course_text(self, course_id: str):
+        """Extracted text of the course's current index, or None if unknown."""
+        with self._lock:
+            cache_key = self._keys.get(course_id)
+            if not cache_key or cache_key in self._texts:
+                return self._texts.get(cache_key)
+        try:
+            with open(self._text_path(cache_key), encoding="utf-8") as f:
+                course_text = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            if course_id in self._stores:
+                self._texts[cache_key] = course_text
+        return course_text
+
+    # ---------- stores ---------- #
+    def register(self, course_id: str, cache_key: str, vector_store, course_text: str = None):
+        """
+        Make vector_store the current index for course_id.
+        course_text (the extracted text it was built from) is kept for course_text().
+        """
+        if course_text is not None:
+            self._save_course_text(cache_key, course_text)
+        with self._lock:
+            if course_text is not None:
+                self._texts[cache_key] = course_text
+            self._stores[course_id] = vector_store
+            self._stores.move_to_end(course_id)
+            old_key = self._keys.get(course_id)
+            if old_key != cache_key:
+                # Answers cached against the old index are stale now
+                if old_key:
+                    get_answer_cache().invalidate(old_key)
+                self._keys[course_id] = cache_key
+                self._save_course_keys()
+            evicted = self._evict()
+        self._save_evicted(evicted)
+
+    def _cached_store(self, course_id: str):
+        # Caller holds the lock
+        if course_id not in self._stores and course_id in self._saving:
+            # Evicted but not on disk yet - take it back
+            self._stores[course_id] = self._saving[course_id][1]
+        if course_id in self._stores:
+            self._stores.move_to_end(course_id)
+            return self._stores[course_id]
+        return None
+
+    @traced()
+    def get(self, course_id: str):
+        """
+        Return the course's vector store, reloading it from disk if it was evicted.
+        Returns None for unknown courses.
+        """
+        with self._lock:
+            vector_store = self._cached_store(course_id)
+            if vector_store is not None or course_id not in self._keys:
+                return vector_store
+            load_lock = self._loading.setdefault(course_id, threading.Lock())
+
+        # One loader per course; other courses (and courses()/cache_key()) aren't blocked
+        with load_lock:
+            with self._lock:
+                vector_store = self._cached_store(course_id)
+                cache_key = self._keys.get(course_id)
+            if vector_store is not None or not cache_key:
+                return vector_store
+
+            vector_store = load_cached_vector_store(cache_key, get_embeddings())
+            if vector_store is None:
+                return None
+
+            with self._lock:
+                if course_id in self._stores or self._keys.get(course_id) != cache_key:
+                    # Re-registered while we were loading - the new index wins
+                    return self._stores.get(course_id)
+                self._stores[course_id] = vector_store
+                evicted = self._evict()
+        self._save_evicted(evicted)
+        return vector_store
+
+    def search(self, course_id: str, query: str, k: int = 3, filter: dict = None):
+        """
+        Similarity search inside one course.
+        filter: metadata to match, e.g. {"source": "week1.pdf"}
+        """
+        vector_store = self.get(course_id)
+        if vector_store is None:
+            return []
+        if filter:
+            return vector_store.similarity_search(query, k=k, filter=filter, fetch_k=max(20, k * 5))
+        return vector_store.similarity_search(query, k=k)
+
+    def _evict(self):
+        """
+        Drop the coldest stores beyond max_in_memory (caller holds the lock).
+        Returns [(course_id, cache_key, store)] for _save_evicted, called after releasing the lock.
+        """
+        evicted = []
+        while len(self._stores) > self.max_in_memory:
+            course_id, vector_store = self._stores.popitem(last=False)
+            cache_key = self._keys.get(course_id)
+            self._texts.pop(cache_key, None)
+            if cache_key:
+                self._saving[course_id] = (cache_key, vector_store)
+                evicted.append((course_id, cache_key, vector_store))
+            print(f"Evicted index for course '{course_id}' from memory")
+        return evicted
+
+    def _save_evicted(self, evicted):
+        for course_id, cache_key, vector_store in evicted:
+            try:
+                if not is_vector_store_cached(cache_key):
+                    save_vector_store(vector_store, cache_key)
+            finally:
+                with self._lock:
+                    if self._saving.get(course_id, (None, None))[1] is vector_store:
+                        del self._saving[course_id]
+
+
+# One manager per process
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_store_manager():
+    """Return the process-wide VectorStoreManager."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = VectorStoreManager()
+    return _manager
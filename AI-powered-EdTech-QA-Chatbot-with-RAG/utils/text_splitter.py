@@ -1,5 +1,12 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.tracing import traced
 
+# Chunking params in tokens (also part of the vector store cache key)
+CHUNK_TOKENS = 254  # MiniLM window (256) minus [CLS] / [SEP]
+CHUNK_OVERLAP_TOKENS = 32
+
+
+@traced()
 def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200):
     """
     Splits text into overlapping chunks for embeddings.
@@ -11,3 +18,59 @@ def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200):
         separators=["\n\n", "\n", ".", " ", ""]
     )
     return splitter.split_text(text)
+
+
+# ---------------- Token-aware Chunking ---------------- #
+def _default_tokenizer():
+    """Tokenizer + max content tokens of the shared embedding model."""
+    from utils.embeddings import get_embeddings
+    model = get_embeddings().client  # SentenceTransformer
+    return model.tokenizer, model.max_seq_length - 2  # room for [CLS] / [SEP]
+
+
+def _snap_to_boundary(text: str, offsets, start_tok: int, end_tok: int) -> int:
+    """
+    Move a chunk end back to a line / sentence break if there is one in the
+    last quarter of the window, so chunks don't stop mid-sentence.
+    """
+    floor = start_tok + (end_tok - start_tok) * 3 // 4
+    for i in range(end_tok - 1, max(floor, start_tok + 1) - 1, -1):
+        gap = text[offsets[i - 1][1]:offsets[i][0]]
+        if "\n" in gap or text[offsets[i - 1][1] - 1:offsets[i - 1][1]] in ".?!":
+            return i
+    return end_tok
+
+
+@traced()
+def iter_token_chunks(pages, max_tokens: int = None, overlap_tokens: int = 32, tokenizer=None):
+    """
+    Generator-based chunker sized by the embedding model's tokenizer.
+    Consumes pages lazily (any iterable of {"page", "text"} dicts) and yields
+    {"text", "page", "start", "end"} where start/end are char offsets in the page text.
+    Chunks never exceed max_tokens, so nothing is silently truncated at embedding time.
+    """
+    if tokenizer is None:
+        tokenizer, limit = _default_tokenizer()
+        max_tokens = min(max_tokens or limit, limit)
+    elif max_tokens is None:
+        raise ValueError("max_tokens is required with a custom tokenizer")
+
+    for page in pages:
+        text = page["text"]
+        if not text.strip():
+            continue
+
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                            verbose=False)["offset_mapping"]
+        start_tok = 0
+        while start_tok < len(offsets):
+            end_tok = min(start_tok + max_tokens, len(offsets))
+            if end_tok < len(offsets):
+                end_tok = _snap_to_boundary(text, offsets, start_tok, end_tok)
+
+            start, end = offsets[start_tok][0], offsets[end_tok - 1][1]
+            yield {"text": text[start:end], "page": page["page"], "start": start, "end": end}
+
+            if end_tok >= len(offsets):
+                break
+            start_tok = max(end_tok - overlap_tokens, start_tok + 1)
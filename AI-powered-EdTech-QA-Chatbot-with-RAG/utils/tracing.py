@@ -0,0 +1,241 @@
+# tracing.py
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set to 0 to turn spans into no-ops
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+# Optional JSON-lines span log (one object per finished span)
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
+# Optional Prometheus endpoint (http://host:port/metrics), 0 = off
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Histogram buckets (seconds): cache hits ... OCR of a large PDF
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_collector = contextvars.ContextVar("span_collector", default=None)
+
+
+# ---------------- Metrics ---------------- #
+class SpanMetrics:
+    """Process-wide per-span-name count / sum / histogram / errors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = defaultdict(int)
+        self.total = defaultdict(float)
+        self.errors = defaultdict(int)
+        self.buckets = defaultdict(lambda: [0] * len(BUCKETS))
+
+    def observe(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            self.count[name] += 1
+            self.total[name] += seconds
+            if error:
+                self.errors[name] += 1
+            counts = self.buckets[name]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+
+    def summary(self) -> list:
+        """[{span, count, total_s, mean_ms, errors}], slowest total first."""
+        with self._lock:
+            rows = [
+                {"span": name, "count": n, "total_s": round(self.total[name], 3),
+                 "mean_ms": round(self.total[name] / n * 1000, 1), "errors": self.errors[name]}
+                for name, n in self.count.items()
+            ]
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def prometheus_text(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP edtech_span_seconds Duration of traced pipeline stages.",
+            "# TYPE edtech_span_seconds histogram",
+        ]
+        with self._lock:
+            for name in sorted(self.count):
+                label = f'span="{name}"'
+                for bound, value in zip(BUCKETS, self.buckets[name]):
+                    lines.append(f'edtech_span_seconds_bucket{{{label},le="{bound}"}} {value}')
+                lines.append(f'edtech_span_seconds_bucket{{{label},le="+Inf"}} {self.count[name]}')
+                lines.append(f"edtech_span_seconds_sum{{{label}}} {self.total[name]:.6f}")
+                lines.append(f"edtech_span_seconds_count{{{label}}} {self.count[name]}")
+            lines.append("# HELP edtech_span_errors_total Traced stages that raised.")
+            lines.append("# TYPE edtech_span_errors_total counter")
+            for name in sorted(self.count):
+                lines.append(f'edtech_span_errors_total{{span="{name}"}} {self.errors[name]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = SpanMetrics()
+_log_lock = threading.Lock()
+
+
+def _finish(record: dict):
+    metrics.observe(record["name"], record["duration_ms"] / 1000, record["error"] is not None)
+
+    spans = _collector.get()
+    if spans is not None:
+        spans.append(record)
+
+    if TRACE_LOG_FILE:
+        with _log_lock, open(TRACE_LOG_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+# ---------------- Spans ---------------- #
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a block: `with span("embed", chunks=len(chunks)) as s: ...`.
+    Yields the span's attrs dict so the block can add results (e.g. s["cache_hit"] = True).
+    Nested spans record their parent; exceptions are recorded and re-raised.
+    """
+    if not TRACING_ENABLED:
+        yield attrs
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    error = None
+    start_time = time.time()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        _finish({
+            "name": name, "parent": parent, "start": start_time,
+            "duration_ms": round(duration_ms, 3), "error": error, "attrs": attrs
+        })
+
+
+def record_span(name: str, duration_ms: float, error: str = None, **attrs):
+    """Record work timed elsewhere (e.g. in a worker process) as a finished span."""
+    if TRACING_ENABLED:
+        _finish({
+            "name": name, "parent": _current_span.get(), "start": time.time() - duration_ms / 1000,
+            "duration_ms": round(duration_ms, 3), "error": error, "attrs": attrs
+        })
+
+
+def _traced_generator(name: str, gen):
+    """Time spent inside the generator only (not in the consumer between items)."""
+    elapsed, items, error = 0.0, 0, None
+    parent = _current_span.get()
+    start_time = time.time()
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(gen)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            items += 1
+            yield item
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            error = type(e).__name__
+        raise
+    finally:
+        gen.close()
+        _finish({
+            "name": name, "parent": parent, "start": start_time,
+            "duration_ms": round(elapsed * 1000, 3), "error": error, "attrs": {"items": items}
+        })
+
+
+def traced(name: str = None):
+    """
+    Decorator form of span(), named module.function (or module.Class.method) by default.
+    Generator functions are timed while they produce items.
+    """
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.split('.')[-1]}.{fn.__qualname__}"
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                if not TRACING_ENABLED:
+                    return fn(*args, **kwargs)
+                return _traced_generator(span_name, fn(*args, **kwargs))
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------------- Collection (in-app panel) ---------------- #
+def start_collection() -> list:
+    """Collect spans finished in this context from now on (e.g. one Streamlit rerun)."""
+    spans = []
+    _collector.set(spans)
+    return spans
+
+
+@contextmanager
+def collect_spans():
+    spans = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+
+# ---------------- Prometheus Endpoint ---------------- #
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the app console
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics on a daemon thread (once per process). No-op when port is 0."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics server not started on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
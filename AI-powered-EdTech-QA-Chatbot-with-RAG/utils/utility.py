@@ -1,7 +1,35 @@
+import json
 import re
+from utils.tracing import traced
 
 ROMAN_NUMS = ["I","II","III","IV","V","VI","VII","VIII","IX","X"]
 
+# Compiled once - the parser runs on every generated quiz
+ANSWER_TYPO = re.compile(r"\bA?nswer:")
+EXPLANATION_TYPO = re.compile(r"\bE?xplanation:")
+EXTRA_NEWLINES = re.compile(r"\n{2,}")
+
+# One alternation = one scan over the text. Every line matches exactly once
+# (other lines via the catch-all), so the scanner never retries mid-line.
+# Answer / explanation lines may have a prefix ("Correct Answer:", "- Answer:"),
+# and an explanation may follow the answer on the same line.
+QUIZ_LINE = re.compile(
+    r"^(?:(?P<question>[IVXLCDM]+\.)[ \t]*(?P<question_text>.*)"
+    r"|[ \t]*(?P<option>\d)\)[ \t]*(?P<option_text>.+)"
+    r"|(?:(?!Explanation:)[^\n])*?\bAnswer:\**[ \t]*(?P<answer>\S*)"
+    r"(?:[ \t]*(?P<inline_explanation>\**Explanation:\**))?.*"
+    r"|[^\n]*?(?P<explanation>\**Explanation:\**).*"
+    r"|(?P<other>.+))",
+    re.MULTILINE
+)
+JSON_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def looks_like_json(text: str) -> bool:
+    """True for structured (JSON mode) quiz output, optionally in a ``` fence."""
+    return JSON_FENCE.sub("", text.strip()).startswith(("{", "["))
+
+
 # -------------------- Clean LLM Output --------------------
 def clean_quiz_text(text: str):
     """
@@ -9,15 +37,112 @@ def clean_quiz_text(text: str):
     - Fix missing letters in "Answer" or "Explanation"
     - Replace fancy quotes
     - Remove extra newlines
+    JSON output is returned as is (quote replacement would break it).
     """
-    text = text.replace("nswer:", "Answer:").replace("xplanation:", "Explanation:")
+    if looks_like_json(text):
+        return text.strip()
+    text = ANSWER_TYPO.sub("Answer:", text)
+    text = EXPLANATION_TYPO.sub("Explanation:", text)
     text = text.replace("\u201c", '"').replace("\u201d", '"')  # fancy quotes
-    text = re.sub(r'\n{2,}', '\n\n', text)  # normalize multiple newlines
+    text = EXTRA_NEWLINES.sub("\n\n", text)  # normalize multiple newlines
     return text.strip()
 
 
 # -------------------- Parse LLM Quiz --------------------
-import re
+def _check_question(q: dict):
+    """Reason the question is malformed, or None if it is usable."""
+    if not q["question"]:
+        return "missing question text"
+    if len(q["options"]) != 4:
+        return f"expected 4 options, found {len(q['options'])}"
+    if q["answer"] not in ("1", "2", "3", "4"):
+        return "missing answer" if not q["answer"] else f"invalid answer '{q['answer']}'"
+    return None
+
+
+def _parse_quiz_json(text: str):
+    """Structured output: {"questions": [{question, options: [4], answer: 1-4, explanation}]}."""
+    try:
+        data = json.loads(JSON_FENCE.sub("", text.strip()))
+    except ValueError as e:
+        return [], [{"number": None, "reason": f"invalid JSON: {e}", "text": text[:200]}]
+
+    items = data.get("questions", []) if isinstance(data, dict) else data
+    quiz_data, malformed = [], []
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            malformed.append({"number": number, "reason": "not an object", "text": str(item)[:200]})
+            continue
+        options = item.get("options") or []
+        if isinstance(options, dict):
+            options = list(options.values())
+        q = {
+            "question": str(item.get("question", "")).strip(),
+            "options": {str(n): str(opt).strip() for n, opt in enumerate(options, 1)},
+            "answer": str(item.get("answer", "")).strip().rstrip(")"),
+            "explanation": str(item.get("explanation", "")).strip()
+        }
+        reason = _check_question(q)
+        if reason:
+            malformed.append({"number": number, "reason": reason, "text": q["question"][:200]})
+        else:
+            quiz_data.append(q)
+    return quiz_data, malformed
+
+
+@traced()
+def parse_quiz_report(quiz_text: str):
+    """
+    Parse quiz text in one pass over its lines (see parse_quiz for the format).
+    JSON-mode output ({"questions": [...]}) is loaded directly instead.
+
+    Returns: (questions, malformed) where malformed lists the dropped questions
+    as {"number", "reason", "text"}, so callers can regenerate just those.
+    """
+    if looks_like_json(quiz_text):
+        return _parse_quiz_json(quiz_text)
+
+    text = quiz_text.strip()
+    quiz_data, malformed = [], []
+    current, explanation_start, number = None, None, 0
+
+    def finish(end: int):
+        if current is None:
+            return
+        if explanation_start is not None:
+            current["explanation"] = text[explanation_start:end].strip()
+        reason = _check_question(current)
+        if reason:
+            malformed.append({"number": number, "reason": reason, "text": current["question"][:200]})
+        else:
+            quiz_data.append(current)
+
+    for match in QUIZ_LINE.finditer(text):
+        (question, question_text, option, option_text, answer, inline_explanation,
+         explanation, other) = match.groups()
+        if question:
+            finish(match.start())
+            number += 1
+            current = {"question": question_text.strip(), "options": {}, "answer": "", "explanation": ""}
+            explanation_start = None
+        elif current is None or explanation_start is not None:
+            continue  # preamble, or lines inside an explanation
+        elif option:
+            current["options"][option] = option_text.strip()
+        elif answer is not None:
+            # First answer wins (a later "Answer:" is usually part of the explanation)
+            current["answer"] = current["answer"] or answer.strip("*).")
+            if inline_explanation:
+                explanation_start = match.end("inline_explanation")
+        elif explanation:
+            explanation_start = match.end("explanation")
+        elif other and not current["question"] and not current["options"]:
+            # "I." on its own line - the question text is on the next line
+            current["question"] = other.strip()
+
+    finish(len(text))
+    return quiz_data, malformed
+
 
 def parse_quiz(quiz_text: str):
     """
@@ -32,53 +157,13 @@ def parse_quiz(quiz_text: str):
     Explanation: <why correct>
     
     Returns: list of dicts with question, options, answer, explanation
+    Malformed questions are skipped (parse_quiz_report lists them).
     """
-    quiz_data = []
-
-    # Split on Roman numeral pattern (I. II. III. etc.)
-    questions = re.split(r"\n(?=[IVXLCDM]+\.)", quiz_text.strip())
-    
-    for q in questions:
-        q = q.strip()
-        if not q:
-            continue
-
-        # Extract question text
-        q_match = re.match(r"^[IVXLCDM]+\.\s*(.+)", q)
-        if not q_match:
-            continue
-        question = q_match.group(1).strip()
-
-        # Extract options (1–4)
-        options = {}
-        opt_matches = re.findall(r"(\d\))\s*(.+)", q)
-        for opt in opt_matches:
-            num = opt[0].replace(")", "").strip()  # "1)", "2)" → "1"
-            options[num] = opt[1].strip()
-
-        # Extract answer
-        ans_match = re.search(r"Answer:\s*([1-4])", q)
-        answer = ans_match.group(1) if ans_match else ""
-
-        # Extract explanation
-        exp_match = re.search(r"Explanation:\s*(.+)", q, re.DOTALL)
-        explanation = exp_match.group(1).strip() if exp_match else ""
-
-        # Skip malformed questions
-        if not (question and len(options) == 4 and answer):
-            continue
-
-        quiz_data.append({
-            "question": question,
-            "options": options,
-            "answer": answer,
-            "explanation": explanation
-        })
-
-    return quiz_data
+    return parse_quiz_report(quiz_text)[0]
 
 
 # -------------------- Parse Student Answers --------------------
+@traced()
 def parse_student_answers(text: str):
     """
     Extract student answers from uploaded text (PDF/TXT).